@@ -0,0 +1,180 @@
+# archive.py
+import glob
+import os
+import re
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+ARCHIVE_DIR = os.getenv('FOOD_DIARY_ARCHIVE_DIR', 'data/archive')
+ARCHIVE_AFTER_DAYS = int(os.getenv('FOOD_DIARY_ARCHIVE_AFTER_DAYS', '365'))
+ARCHIVE_CHUNK_SIZE = 5_000
+
+# Колонки food_entries, которые переносятся в архив
+ARCHIVE_COLUMNS = (
+    'id, user_id, food_text, calories, protein_g, fat_g, carbs_g, '
+    'advice, created_at, local_day'
+)
+
+
+class DiaryArchiver:
+    """Перенос старых записей food_entries в архивные файлы по годам.
+
+    Горячая база хранит только свежие записи и итоги (daily_totals и
+    недельные/месячные), поэтому остается маленькой. Старые записи лежат
+    в data/archive/food_diary_YYYY.db и подключаются через ATTACH только
+    для длинных отчетов и выгрузок.
+    """
+
+    def __init__(self, db, archive_dir=ARCHIVE_DIR, after_days=ARCHIVE_AFTER_DAYS):
+        self.db = db
+        self.archive_dir = archive_dir
+        self.after_days = after_days
+
+    def _path(self, year):
+        return os.path.join(self.archive_dir, f'food_diary_{year}.db')
+
+    def years(self):
+        """Годы, для которых есть архивные файлы (по убыванию)"""
+        years = []
+        for path in glob.glob(os.path.join(self.archive_dir, 'food_diary_*.db')):
+            match = re.search(r'food_diary_(\d{4})\.db$', path)
+            if match:
+                years.append(int(match.group(1)))
+        return sorted(years, reverse=True)
+
+    @contextmanager
+    def attached(self, conn, year):
+        """Подключаем архив года как схему arch_YYYY на время блока"""
+        schema = f'arch_{year}'
+        conn.execute('ATTACH DATABASE ? AS ' + schema, (self._path(year),))
+        try:
+            yield schema
+        finally:
+            # Незавершенную транзакцию (ошибка внутри блока) откатываем
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute('DETACH DATABASE ' + schema)
+
+    def _ensure_schema(self, conn, schema):
+        conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema}.food_entries (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            food_text TEXT,
+            calories INTEGER,
+            protein_g REAL,
+            fat_g REAL,
+            carbs_g REAL,
+            advice TEXT,
+            created_at TIMESTAMP,
+            local_day INTEGER
+        )
+        ''')
+        conn.execute(f'''
+        CREATE INDEX IF NOT EXISTS {schema}.idx_food_entries_user_created
+        ON food_entries (user_id, created_at)
+        ''')
+
+    def archive_old_entries(self, chunk_size=ARCHIVE_CHUNK_SIZE):
+        """Переносим записи старше after_days дней, возвращаем их количество"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        cutoff = (datetime.utcnow() - timedelta(days=self.after_days)).strftime('%Y-%m-%d %H:%M:%S')
+
+        moved = 0
+        last_id = 0
+        while True:
+            # Каждая порция - отдельная транзакция, писатель не занят надолго
+            with self.db.pool.writer() as conn:
+                rows = conn.execute('''
+                SELECT id, substr(created_at, 1, 4) FROM food_entries
+                WHERE id > ? AND created_at < ?
+                ORDER BY id
+                LIMIT ?
+                ''', (last_id, cutoff, chunk_size)).fetchall()
+                if not rows:
+                    break
+
+                by_year = {}
+                for entry_id, year in rows:
+                    by_year.setdefault(int(year), []).append(entry_id)
+
+                # ATTACH нельзя внутри транзакции
+                if conn.in_transaction:
+                    conn.commit()
+
+                for year, ids in by_year.items():
+                    with self.attached(conn, year) as schema:
+                        self._ensure_schema(conn, schema)
+                        placeholders = ','.join('?' * len(ids))
+
+                        # В режиме WAL commit двух файлов не атомарен, поэтому
+                        # сначала сохраняем копию в архиве и только потом удаляем.
+                        # После сбоя между шагами повторный запуск просто
+                        # перезапишет копию (INSERT OR REPLACE) и удалит оригинал.
+                        conn.execute(f'''
+                        INSERT OR REPLACE INTO {schema}.food_entries ({ARCHIVE_COLUMNS})
+                        SELECT {ARCHIVE_COLUMNS} FROM main.food_entries
+                        WHERE id IN ({placeholders})
+                        ''', ids)
+                        conn.commit()
+
+                        conn.execute(f'''
+                        DELETE FROM main.food_entries WHERE id IN ({placeholders})
+                        ''', ids)
+                        conn.commit()
+
+                moved += len(rows)
+                last_id = rows[-1][0]
+
+        if moved:
+            print(f"📦 В архив перенесено записей: {moved}")
+        return moved
+
+    def get_entries(self, conn, user_id, limit, before):
+        """Записи пользователя из архива, новые сначала (как get_all_entries)"""
+        entries = []
+        for year in self.years():
+            if len(entries) >= limit:
+                break
+            if str(year) > before[:4]:
+                continue
+
+            with self.attached(conn, year) as schema:
+                entries.extend(conn.execute(f'''
+                SELECT
+                    food_text,
+                    calories,
+                    protein_g,
+                    fat_g,
+                    carbs_g,
+                    created_at
+                FROM {schema}.food_entries
+                WHERE user_id = ? AND created_at < ?
+                ORDER BY created_at DESC
+                LIMIT ?
+                ''', (user_id, before, limit - len(entries))).fetchall())
+
+        return entries
+
+    def count_entries(self, conn, user_id):
+        """Число записей пользователя во всех архивах"""
+        count = 0
+        for year in self.years():
+            with self.attached(conn, year) as schema:
+                count += conn.execute(f'''
+                SELECT COUNT(*) FROM {schema}.food_entries WHERE user_id = ?
+                ''', (user_id,)).fetchone()[0]
+        return count
+
+
+if __name__ == '__main__':
+    import sys
+    from sharding import open_database
+
+    # python archive.py [дней]
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else ARCHIVE_AFTER_DAYS
+    db = open_database()
+    # У каждого шарда свой каталог архива
+    for database in getattr(db, 'shards', [db]):
+        DiaryArchiver(database, database.archive.archive_dir, after_days=days).archive_old_entries()
+    db.close()
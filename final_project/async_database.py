@@ -0,0 +1,88 @@
+# async_database.py
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from database import Database, READ_POOL_SIZE
+
+# Методы Database, которые пишут в базу. Они выполняются в потоке писателя
+# своего шарда по порядку, все остальные - в пуле потоков чтения.
+WRITE_METHODS = {
+    'add_user',
+    'add_food_entry',
+    'create_tables',
+    'rebuild_rollups',
+    'rebuild_food_terms',
+    'set_user_timezone',
+    'backfill_local_day',
+}
+
+
+class AsyncDatabase:
+    """Асинхронная обертка над Database.
+
+    Те же методы, что у Database, но возвращают awaitable. Запросы к
+    SQLite выполняются в отдельных потоках, поэтому медленный диск не
+    останавливает цикл событий бота.
+    """
+
+    def __init__(self, db=None, read_workers=READ_POOL_SIZE):
+        self.db = db or Database()
+        # По одному потоку писателя на шард, чтобы шарды писали параллельно
+        self._writers = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'db-writer-{i}')
+            for i in range(self.db.shard_count)
+        ]
+        self._readers = ThreadPoolExecutor(
+            max_workers=read_workers * self.db.shard_count,
+            thread_name_prefix='db-reader'
+        )
+
+    def _writer_for(self, user_id=None):
+        if user_id is None:
+            return self._writers[0]
+        return self._writers[self.db.shard_index(user_id)]
+
+    async def run(self, func, *args, write=False, user_id=None, **kwargs):
+        """Выполнить произвольную синхронную функцию в потоке БД"""
+        loop = asyncio.get_running_loop()
+        executor = self._writer_for(user_id) if write else self._readers
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+    async def add_food_entry(self, user_id, food_text, nutrition_data):
+        """Запись приема пищи. При групповой записи ждем commit пачки,
+        не занимая поток писателя, чтобы пачка могла набраться."""
+        if self.db.batcher:
+            future = self.db.submit_food_entry(user_id, food_text, nutrition_data)
+            return await asyncio.wrap_future(future)
+        return await self.run(self.db.add_food_entry, user_id, food_text, nutrition_data,
+                              write=True, user_id=user_id)
+
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+        if not callable(method):
+            return method
+
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            if name in WRITE_METHODS:
+                # Первый аргумент пишущих методов - user_id (если он есть)
+                user_id = args[0] if args and isinstance(args[0], int) else None
+                executor = self._writer_for(user_id)
+            else:
+                executor = self._readers
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, functools.partial(method, *args, **kwargs))
+
+        return wrapper
+
+    async def close(self):
+        """Дожидаемся очереди записей и закрываем базу"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._shutdown)
+
+    def _shutdown(self):
+        for writer in self._writers:
+            writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self.db.close()
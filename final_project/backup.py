@@ -0,0 +1,161 @@
+# backup.py
+import json
+import os
+import shutil
+import sqlite3
+from datetime import datetime
+
+BACKUP_DIR = os.getenv('FOOD_DIARY_BACKUP_DIR', 'data/backups')
+BACKUP_KEEP = int(os.getenv('FOOD_DIARY_BACKUP_KEEP', '7'))
+BACKUP_INTERVAL_HOURS = float(os.getenv('FOOD_DIARY_BACKUP_HOURS', '6'))
+
+# Копируем по BACKUP_STEP_PAGES страниц и делаем паузу между шагами
+BACKUP_STEP_PAGES = 64
+BACKUP_STEP_SLEEP = 0.005
+
+MANIFEST = 'manifest.json'
+
+
+def _fingerprint(path):
+    """Размер и время изменения файла базы и его WAL.
+
+    Любой commit меняет -wal (или сам файл после checkpoint),
+    поэтому одинаковый отпечаток значит, что данные не менялись.
+    """
+    result = []
+    for name in (path, path + '-wal'):
+        try:
+            stat = os.stat(name)
+            result.append([stat.st_size, stat.st_mtime_ns])
+        except FileNotFoundError:
+            result.append(None)
+    return result
+
+
+class DiaryBackup:
+    """Горячие резервные копии без остановки бота.
+
+    Каждый снимок - папка data/backups/YYYYmmdd-HHMMSS-ffffff с копиями всех
+    файлов базы (для шардов - каждого шарда и справочника). Копия
+    делается через backup API SQLite небольшими шагами из отдельного
+    соединения только для чтения. На время копии это соединение держит
+    открытую транзакцию чтения: в режиме WAL она не мешает писателю,
+    но фиксирует снимок, поэтому копия согласована (вместе с данными,
+    которые еще лежат в -wal) и не начинается заново после каждой записи.
+
+    Снимки инкрементальные: если файл не менялся с прошлого снимка,
+    вместо копии ставится жесткая ссылка на предыдущую.
+    Архивы по годам (archive.py) не копируются - они меняются только
+    при архивации и сохраняются отдельно как обычные файлы.
+    """
+
+    def __init__(self, db, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP,
+                 pages=BACKUP_STEP_PAGES, sleep=BACKUP_STEP_SLEEP):
+        self.db = db
+        self.backup_dir = backup_dir
+        self.keep = keep
+        self.pages = pages
+        self.sleep = sleep
+
+    def snapshots(self):
+        """Папки снимков, от старых к новым"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        return sorted(
+            name for name in os.listdir(self.backup_dir)
+            if os.path.isfile(os.path.join(self.backup_dir, name, MANIFEST))
+        )
+
+    def _load_manifest(self, snapshot):
+        with open(os.path.join(self.backup_dir, snapshot, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+
+    def _copy(self, path, target):
+        """Постраничная копия одной базы в target"""
+        tmp = target + '.tmp'
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+        source = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        destination = sqlite3.connect(tmp)
+        try:
+            # Открытая транзакция чтения фиксирует снимок базы на время копии
+            source.execute('BEGIN')
+            source.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+            source.backup(destination, pages=self.pages, sleep=self.sleep)
+            source.rollback()
+
+            if destination.execute('PRAGMA quick_check').fetchone()[0] != 'ok':
+                raise sqlite3.DatabaseError(f'копия {path} не прошла quick_check')
+        finally:
+            destination.close()
+            source.close()
+
+        os.replace(tmp, target)
+
+    def _link_or_copy(self, previous, target):
+        try:
+            os.link(previous, target)
+        except OSError:
+            shutil.copy2(previous, target)
+
+    def backup(self):
+        """Делаем снимок, возвращаем (папка, скопировано, без изменений)"""
+        previous = self.snapshots()
+        previous_manifest = self._load_manifest(previous[-1]) if previous else {}
+        previous_dir = os.path.join(self.backup_dir, previous[-1]) if previous else None
+
+        name = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        snapshot_dir = os.path.join(self.backup_dir, name)
+        os.makedirs(snapshot_dir, exist_ok=True)
+
+        manifest = {}
+        copied = 0
+        unchanged = 0
+        for path in self.db.database_files():
+            if not os.path.exists(path):
+                continue
+
+            filename = os.path.basename(path)
+            target = os.path.join(snapshot_dir, filename)
+            # Отпечаток берем до копии: запись во время копии даст новый
+            # отпечаток и следующий снимок скопирует файл заново
+            fingerprint = _fingerprint(path)
+
+            if previous_manifest.get(filename) == fingerprint:
+                self._link_or_copy(os.path.join(previous_dir, filename), target)
+                unchanged += 1
+            else:
+                self._copy(path, target)
+                copied += 1
+            manifest[filename] = fingerprint
+
+        # Манифест пишется последним: снимок без него считается незавершенным
+        with open(os.path.join(snapshot_dir, MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+
+        self.cleanup()
+        print(f"💾 Резервная копия {name}: скопировано {copied}, без изменений {unchanged}")
+        return snapshot_dir, copied, unchanged
+
+    def cleanup(self):
+        """Оставляем keep последних снимков и удаляем незавершенные"""
+        complete = self.snapshots()
+        for snapshot in complete[:-max(self.keep, 1)]:
+            shutil.rmtree(os.path.join(self.backup_dir, snapshot), ignore_errors=True)
+
+        latest = complete[-1] if complete else ''
+        for name in os.listdir(self.backup_dir):
+            path = os.path.join(self.backup_dir, name)
+            # Папки без манифеста старше последнего снимка - оборванные копии
+            if os.path.isdir(path) and name not in complete and name < latest:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    from sharding import open_database
+
+    # python backup.py
+    db = open_database()
+    DiaryBackup(db).backup()
+    db.close()
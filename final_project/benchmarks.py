@@ -0,0 +1,359 @@
+# benchmarks.py
+"""Замеры производительности хранилища (проверки корректности - checks.py).
+
+Запуск:
+    python benchmarks.py today [кол-во строк]
+    python benchmarks.py group_commit [кол-во приемов пищи] [потоков]
+    python benchmarks.py sharding [кол-во приемов пищи] [потоков] [шардов]
+    python benchmarks.py backup [кол-во строк]
+    python benchmarks.py search [кол-во строк]
+    python benchmarks.py food_stats [кол-во строк]
+    python benchmarks.py catalog [кол-во продуктов ...]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from backup import DiaryBackup
+from database import Database
+from food_catalog import FoodCatalog
+from food_terms import extract_food_terms
+from sharding import ShardedDatabase
+
+FOODS = [
+    'овсянка 100г', 'гречка с курицей', 'творог 200г и банан', 'яблоко, кофе',
+    'салат из овощей', 'борщ со сметаной', 'омлет из двух яиц', 'рис с овощами',
+    'котлета с пюре', 'йогурт греческий', 'бутерброд с сыром', 'суп куриный',
+]
+
+NUTRITION = {
+    'calories': 350,
+    'protein_g': 12.0,
+    'fat_g': 6.0,
+    'carbs_g': 60.0,
+    'advice': 'benchmark'
+}
+
+
+def _timeit(func, repeat=50):
+    """Медиана времени выполнения в миллисекундах"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def _fill_entries(conn, rows, users, days=365, batch=100_000):
+    """Заполняем food_entries случайными записями за последний год"""
+    now = datetime.now()
+    rnd = random.Random(42)
+
+    def generate(count):
+        for _ in range(count):
+            moment = now - timedelta(seconds=rnd.randrange(days * 86400))
+            yield (
+                rnd.randrange(1, users + 1),
+                rnd.choice(FOODS),
+                350, 12.0, 6.0, 60.0, 'benchmark',
+                moment.strftime('%Y-%m-%d %H:%M:%S'),
+                int(moment.strftime('%Y%m%d'))
+            )
+
+    done = 0
+    while done < rows:
+        count = min(batch, rows - done)
+        conn.executemany('''
+        INSERT INTO food_entries
+        (user_id, food_text, calories, protein_g, fat_g, carbs_g, advice, created_at, local_day)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', generate(count))
+        conn.commit()
+        done += count
+        print(f"   ... {done:,} / {rows:,}")
+
+
+def bench_today(rows=10_000_000, users=10_000):
+    """/today до и после индексов и колонки local_day"""
+    workdir = tempfile.mkdtemp(prefix='food_bench_')
+    path = os.path.join(workdir, 'food_diary.db')
+    print(f"📦 База: {path}")
+
+    # Схема как до миграции: без индекса и с user_version = 0
+    db = Database(path)
+    db.conn.execute('DROP INDEX IF EXISTS idx_food_entries_user_created')
+    db.conn.execute('DROP INDEX IF EXISTS idx_food_entries_user_day')
+    db.conn.execute('PRAGMA user_version = 0')
+    db.conn.commit()
+
+    print(f"📝 Заполняю {rows:,} строк...")
+    _fill_entries(db.conn, rows, users)
+    for _ in range(5):
+        db.add_food_entry(1, 'гречка 200г', NUTRITION)
+    db.close()
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    conn = sqlite3.connect(path)
+
+    def old_query():
+        conn.execute('''
+        SELECT food_text, calories, protein_g, fat_g, carbs_g, advice, created_at
+        FROM food_entries
+        WHERE user_id = ? AND DATE(created_at) = ?
+        ORDER BY created_at
+        ''', (1, today)).fetchall()
+
+    before = _timeit(old_query, repeat=5)
+    conn.close()
+
+    # Повторное открытие запускает миграцию и строит индекс
+    start = time.perf_counter()
+    db = Database(path)
+    migration = time.perf_counter() - start
+
+    # Мимо кэша отчетов - меряем сам запрос
+    query = Database.get_today_entries.__wrapped__
+    after = _timeit(lambda: query(db, 1))
+    db.close()
+
+    print(f"\n⏱  /today при {rows:,} строк")
+    print(f"   до:       {before:10.2f} мс")
+    print(f"   после:    {after:10.2f} мс")
+    print(f"   миграция: {migration:10.2f} с")
+
+
+def _meals_per_second(db, meals, threads):
+    """Пишем meals приемов пищи из threads потоков, каждый ждет свой commit"""
+    per_thread = meals // threads
+
+    def worker(user_id):
+        for _ in range(per_thread):
+            db.add_food_entry(user_id, 'овсянка 100г', NUTRITION)
+
+    workers = [threading.Thread(target=worker, args=(i + 1,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+
+def bench_group_commit(meals=20_000, threads=64):
+    """Приемов пищи в секунду: commit на каждую запись против групповой записи.
+
+    Оба варианта с synchronous=FULL, то есть с одинаковой гарантией сохранности.
+    """
+    workdir = tempfile.mkdtemp(prefix='food_bench_')
+
+    db = Database(os.path.join(workdir, 'per_call.db'), synchronous='FULL')
+    per_call = _meals_per_second(db, meals, threads)
+    db.close()
+
+    db = Database(os.path.join(workdir, 'group.db'), group_commit=True)
+    grouped = _meals_per_second(db, meals, threads)
+    db.close()
+
+    print(f"⏱  {meals:,} приемов пищи из {threads} потоков")
+    print(f"   commit на запись:  {per_call:10.0f} записей/с")
+    print(f"   групповая запись:  {grouped:10.0f} записей/с")
+    print(f"   ускорение:         {grouped / per_call:10.1f}x")
+
+
+def bench_sharding(meals=20_000, threads=64, shards=4):
+    """Приемов пищи в секунду: один файл против нескольких шардов (synchronous=FULL)"""
+    workdir = tempfile.mkdtemp(prefix='food_bench_')
+
+    db = ShardedDatabase(1, os.path.join(workdir, 'one'), synchronous='FULL')
+    single = _meals_per_second(db, meals, threads)
+    db.close()
+
+    db = ShardedDatabase(shards, os.path.join(workdir, 'many'), synchronous='FULL')
+    sharded = _meals_per_second(db, meals, threads)
+    db.close()
+
+    print(f"⏱  {meals:,} приемов пищи из {threads} потоков")
+    print(f"   1 шард:        {single:10.0f} записей/с")
+    print(f"   {shards} шарда(ов):   {sharded:10.0f} записей/с")
+    print(f"   ускорение:     {sharded / single:10.1f}x")
+
+
+def bench_backup(rows=500_000):
+    """Задержка add_food_entry во время горячего резервного копирования"""
+    workdir = tempfile.mkdtemp(prefix='food_bench_')
+    db = Database(os.path.join(workdir, 'food_diary.db'), group_commit=False)
+    with db.pool.writer() as conn:
+        _fill_entries(conn, rows, users=1_000)
+
+    latencies = []
+    done = threading.Event()
+
+    def writer():
+        while not done.is_set():
+            start = time.perf_counter()
+            db.add_food_entry(1, 'овсянка 100г', NUTRITION)
+            latencies.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.001)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    start = time.perf_counter()
+    snapshot_dir, _, _ = DiaryBackup(db, os.path.join(workdir, 'backups')).backup()
+    elapsed = time.perf_counter() - start
+    done.set()
+    thread.join()
+
+    backup = sqlite3.connect(os.path.join(snapshot_dir, 'food_diary.db'))
+    copied_rows = backup.execute('SELECT COUNT(*) FROM food_entries').fetchone()[0]
+    backup.close()
+    db.close()
+
+    latencies.sort()
+    print(f"⏱  Резервная копия {rows:,} строк: {elapsed:.2f} с, в копии {copied_rows:,} строк")
+    print(f"   записей во время копии: {len(latencies)}")
+    print(f"   задержка записи p50: {latencies[len(latencies) // 2]:.2f} мс, "
+          f"p99: {latencies[int(len(latencies) * 0.99)]:.2f} мс, max: {latencies[-1]:.2f} мс")
+
+
+def bench_search(rows=1_000_000, users=1_000):
+    """Поиск по тексту: FTS5 против LIKE '%...%'"""
+    workdir = tempfile.mkdtemp(prefix='food_bench_')
+    db = Database(os.path.join(workdir, 'food_diary.db'))
+    with db.pool.writer() as conn:
+        _fill_entries(conn, rows, users)
+
+    user_id = users // 2
+
+    def like():
+        with db.pool.reader() as conn:
+            conn.execute('''
+            SELECT id FROM food_entries
+            WHERE food_text LIKE ?
+            ORDER BY local_day DESC
+            LIMIT 20
+            ''', ('%гречк%',)).fetchall()
+
+    def like_user():
+        with db.pool.reader() as conn:
+            conn.execute('''
+            SELECT id FROM food_entries
+            WHERE user_id = ? AND food_text LIKE ?
+            ORDER BY local_day DESC
+            LIMIT 20
+            ''', (user_id, '%гречк%')).fetchall()
+
+    found = len(db.search_entries(user_id, 'гречку'))
+    print(f"⏱  {rows:,} записей, {users:,} пользователей, найдено {found}")
+    print(f"   LIKE по всей таблице:      {_timeit(like, 5):8.2f} мс")
+    print(f"   LIKE по пользователю:      {_timeit(like_user):8.2f} мс")
+    print(f"   FTS5 search_entries:       {_timeit(lambda: db.search_entries(user_id, 'гречку')):8.2f} мс")
+    db.close()
+
+
+def bench_food_stats(rows=1_000_000, users=100):
+    """Частые продукты за всю историю: Counter по записям против user_food_terms"""
+    workdir = tempfile.mkdtemp(prefix='food_bench_')
+    db = Database(os.path.join(workdir, 'food_diary.db'))
+    with db.pool.writer() as conn:
+        _fill_entries(conn, rows, users)
+    db.rebuild_food_terms()
+
+    user_id = users // 2
+
+    def counter():
+        counts = Counter()
+        for entry in db.get_all_entries(user_id, limit=rows):
+            counts.update(term for term, _ in extract_food_terms(entry[0]))
+        return counts.most_common(5)
+
+    def indexed():
+        return Database.get_food_stats.__wrapped__(db, user_id)['top_foods']
+
+    assert [count for _, count in counter()] == [count for _, count in indexed()]
+    print(f"⏱  {rows:,} записей, {users} пользователей (~{rows // users:,} записей на пользователя)")
+    print(f"   Counter по всем записям:   {_timeit(counter, 5):8.2f} мс")
+    print(f"   user_food_terms + LIMIT:   {_timeit(indexed):8.2f} мс")
+    db.close()
+
+
+def _random_word(rnd):
+    return ''.join(rnd.choice('абвгдежзиклмнопрстуфхцчшэюя') for _ in range(rnd.randint(4, 10)))
+
+
+def bench_catalog(*sizes):
+    """Поиск продукта в сообщении: автомат Ахо-Корасик против перебора названий,
+    и нечеткий поиск по триграммам для названий с опечаткой"""
+    rnd = random.Random(42)
+    data = {'calories': 350.0, 'protein': 12.0, 'fat': 6.0, 'carbs': 60.0}
+    for size in sizes or (10_000, 100_000):
+        products = []
+        for i in range(size):
+            name = ' '.join(_random_word(rnd) for _ in range(rnd.randint(1, 2)))
+            synonyms = [_random_word(rnd) for _ in range(2)]
+            products.append((name, data, synonyms))
+
+        start = time.perf_counter()
+        catalog = FoodCatalog(products)
+        build = time.perf_counter() - start
+
+        patterns = [(pattern, name) for name, _, synonyms in products for pattern in (name, *synonyms)]
+        messages = [f"{rnd.choice(FOODS)} и {rnd.choice(patterns)[0]} 150г" for _ in range(100)]
+
+        # Опечатка: одна буква в названии удвоена
+        typos = []
+        for _ in range(100):
+            pattern, name = rnd.choice(patterns)
+            i = rnd.randrange(len(pattern))
+            typos.append((f"{pattern[:i]}{pattern[i]}{pattern[i:]} 150г", name))
+
+        def scan():
+            for message in messages:
+                for pattern, name in patterns:
+                    if pattern in message:
+                        break
+
+        def automaton():
+            for message in messages:
+                catalog.match(message)
+
+        def fuzzy():
+            for message, _ in typos:
+                catalog.fuzzy_match(message, 0.8)
+
+        found = sum(
+            1 for message, name in typos
+            if (catalog.fuzzy_match(message, 0.8) or (None,))[0] == name
+        )
+
+        print(f"⏱  {size:,} продуктов, {len(patterns):,} названий, "
+              f"{len(catalog._goto):,} состояний, сборка {build:.1f} с")
+        print(f"   перебор названий:          {_timeit(scan, 3) / len(messages):8.3f} мс на сообщение")
+        print(f"   FoodCatalog.match:         {_timeit(automaton, 5) / len(messages):8.3f} мс на сообщение")
+        print(f"   FoodCatalog.fuzzy_match:   {_timeit(fuzzy, 3) / len(typos):8.3f} мс на сообщение "
+              f"(найдено {found} из {len(typos)})")
+
+
+BENCHMARKS = {
+    'today': bench_today,
+    'group_commit': bench_group_commit,
+    'sharding': bench_sharding,
+    'backup': bench_backup,
+    'search': bench_search,
+    'food_stats': bench_food_stats,
+    'catalog': bench_catalog,
+}
+
+
+if __name__ == '__main__':
+    name = sys.argv[1] if len(sys.argv) > 1 else 'today'
+    args = [int(arg) for arg in sys.argv[2:]]
+    BENCHMARKS[name](*args)
@@ -1,9 +1,19 @@
 # bot.py
+import asyncio
 import logging
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
+import os
+import tempfile
+from telegram import (
+    Update,
+    ReplyKeyboardMarkup,
+    KeyboardButton,
+    InlineKeyboardMarkup,
+    InlineKeyboardButton
+)
 from telegram.ext import (
     Application,
     CommandHandler,
+    CallbackQueryHandler,
     MessageHandler,
     filters,
     ContextTypes,
@@ -13,16 +23,25 @@ from utils import (
     format_nutrition_response,
     format_daily_summary,
     format_weekly_analysis,
+    format_weeks_comparison,
     format_monthly_analysis,
     format_general_stats,
+    format_history_page,
+    format_search_results,
+    encode_history_cursor,
+    decode_history_cursor,
     get_meal_time
 )
 from analytics import NutritionAnalytics
-from collections import Counter
 from charts import NutritionCharts
-from config import TELEGRAM_TOKEN
+from config import TELEGRAM_TOKEN, ADMIN_IDS
 from openrouter_api import OpenRouterNutrition
-from database import Database
+from estimate_cache import EstimateCache, format_cache_stats
+from sharding import open_database
+from async_database import AsyncDatabase
+from diary_io import export_diary, import_diary, detect_format
+from backup import DiaryBackup, BACKUP_INTERVAL_HOURS
+from maintenance import DiaryMaintenance, MAINTENANCE_INTERVAL_MINUTES, format_maintenance_report
 
 # Настройка логирования
 logging.basicConfig(
@@ -32,8 +51,9 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Инициализация
-db = Database()
-nutrition_api = OpenRouterNutrition()
+db = AsyncDatabase(open_database())
+maintenance = DiaryMaintenance(db.db)
+nutrition_api = OpenRouterNutrition(cache=EstimateCache())
 
 # Состояния для ConversationHandler
 WAITING_FOOD_INPUT = 1
@@ -48,6 +68,27 @@ def create_main_keyboard():
     ]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
+def create_history_keyboard(page):
+    """Кнопки листания истории (курсор зашит в callback_data)"""
+    entries = page['entries']
+    if not entries:
+        return None
+
+    buttons = []
+    if page['has_newer']:
+        newest = entries[0]
+        buttons.append(InlineKeyboardButton(
+            "◀️ Новее",
+            callback_data=encode_history_cursor(False, newest[6], newest[0])
+        ))
+    if page['has_older']:
+        oldest = entries[-1]
+        buttons.append(InlineKeyboardButton(
+            "Раньше ▶️",
+            callback_data=encode_history_cursor(True, oldest[6], oldest[0])
+        ))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
 def create_cancel_keyboard():
     """Клавиатура с кнопкой отмены"""
     keyboard = [[KeyboardButton("❌ Отмена")]]
@@ -61,7 +102,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
     # Добавляем пользователя в БД
-    db.add_user(user.id, user.username, user.first_name)
+    await db.add_user(user.id, user.username, user.first_name)
 
     welcome_message = f"""
 🍎 *Привет, {user.first_name}!* 
@@ -90,6 +131,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 `/week` - недельная статистика
 `/month` - статистика за месяц
 `/chart` - график КБЖУ
+`/history` - история приемов пищи
+`/search [еда]` - когда я это ел
+`/timezone` - часовой пояс
+`/export` - выгрузить дневник (csv/jsonl)
+`/import` - загрузить дневник из файла
 `/start` - вводное сообщение
 `/help` - помощь
 
@@ -151,10 +197,10 @@ async def handle_food_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         # Получаем данные от OpenRouter или локальной базы
-        nutrition_data = nutrition_api.estimate_nutrition(food_text)
+        nutrition_data = await nutrition_api.estimate_nutrition_async(food_text)
 
         # Сохраняем в БД
-        db.add_food_entry(user.id, food_text, nutrition_data)
+        await db.add_food_entry(user.id, food_text, nutrition_data)
 
         # Форматируем ответ
         response = format_nutrition_response(nutrition_data, food_text)
@@ -164,6 +210,8 @@ async def handle_food_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
             source_info = {
                 "openrouter_gpt": "🤖 Анализ от нейросети GPT-3.5",
                 "local_db": "📊 Данные из локальной базы",
+                "cache": "💾 Сохраненная оценка нейросети",
+                "meal": "🧩 Сумма по продуктам",
                 "fallback_estimate": "⚖️ Примерная оценка"
             }
             source_text = source_info.get(nutrition_data["source"], "")
@@ -242,10 +290,10 @@ async def add_food_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         # Получаем данные от OpenRouter или локальной базы
-        nutrition_data = nutrition_api.estimate_nutrition(food_text)
+        nutrition_data = await nutrition_api.estimate_nutrition_async(food_text)
 
         # Сохраняем в БД
-        db.add_food_entry(user.id, food_text, nutrition_data)
+        await db.add_food_entry(user.id, food_text, nutrition_data)
 
         # Форматируем ответ
         response = format_nutrition_response(nutrition_data, food_text)
@@ -255,6 +303,8 @@ async def add_food_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             source_info = {
                 "openrouter_gpt": "🤖 Анализ от нейросети GPT-3.5",
                 "local_db": "📊 Данные из локальной базы",
+                "cache": "💾 Сохраненная оценка нейросети",
+                "meal": "🧩 Сумма по продуктам",
                 "fallback_estimate": "⚖️ Примерная оценка"
             }
             source_text = source_info.get(nutrition_data["source"], "")
@@ -281,8 +331,8 @@ async def today_summary(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
     # Получаем данные из БД
-    summary = db.get_today_summary(user.id)
-    entries = db.get_today_entries(user.id)
+    summary = await db.get_today_summary(user.id)
+    entries = await db.get_today_entries(user.id)
 
     # Форматируем ответ
     response = format_daily_summary(summary, entries)
@@ -298,10 +348,10 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Общая статистика"""
     user = update.effective_user
 
-    # Получаем все записи
-    all_entries = db.get_all_entries(user.id, limit=50)
+    # Число записей и частые продукты за всю историю (user_food_terms)
+    stats = await db.get_food_stats(user.id)
 
-    if not all_entries:
+    if not stats['entries'] and not stats['top_foods']:
         await update.message.reply_text(
             "📊 *ОБЩАЯ СТАТИСТИКА*\n═" * 18 + "\n\n📭 *У вас еще нет записей*\n\nНачните с добавления первого приема пищи!",
             parse_mode='Markdown',
@@ -309,16 +359,8 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    # Анализ самых частых продуктов
-    food_words = []
-    for food_text, _, _, _, _, _ in all_entries:
-        words = food_text.lower().split()
-        food_words.extend([w for w in words if len(w) > 2])
-
-    common_words = Counter(food_words).most_common(5)
-
     # Форматируем ответ
-    response = format_general_stats(all_entries, common_words)
+    response = format_general_stats(stats['entries'], stats['top_foods'])
 
     await update.message.reply_text(
         response,
@@ -327,6 +369,230 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /history - первая страница истории"""
+    user = update.effective_user
+
+    page = await db.get_history_page(user.id)
+
+    await update.message.reply_text(
+        format_history_page(page),
+        parse_mode='Markdown',
+        reply_markup=create_history_keyboard(page)
+    )
+
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /search - поиск по дневнику"""
+    user = update.effective_user
+    query = ' '.join(context.args)
+
+    if not query:
+        await update.message.reply_text(
+            "🔎 Укажите, что искать.\n\nПример: `/search гречка`",
+            parse_mode='Markdown',
+            reply_markup=create_main_keyboard()
+        )
+        return
+
+    entries = await db.search_entries(user.id, query)
+
+    await update.message.reply_text(
+        format_search_results(query, entries),
+        parse_mode='Markdown',
+        reply_markup=create_main_keyboard()
+    )
+
+
+async def history_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листание истории кнопками"""
+    query = update.callback_query
+    await query.answer()
+
+    decoded = decode_history_cursor(query.data)
+    if not decoded:
+        return
+    older, cursor = decoded
+
+    page = await db.get_history_page(query.from_user.id, cursor, older)
+
+    try:
+        await query.edit_message_text(
+            format_history_page(page),
+            parse_mode='Markdown',
+            reply_markup=create_history_keyboard(page)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка листания истории: {e}")
+
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /export [csv|jsonl]"""
+    user = update.effective_user
+    fmt = 'jsonl' if context.args and context.args[0].lower() in ('jsonl', 'json') else 'csv'
+
+    processing_msg = await update.message.reply_text(
+        "📤 *Готовлю выгрузку дневника...*",
+        parse_mode='Markdown'
+    )
+
+    fd, path = tempfile.mkstemp(suffix=f'.{fmt}')
+    os.close(fd)
+    try:
+        # Выгрузка идет потоком из БД в файл, в памяти ничего не копится
+        count = await db.run(export_diary, db.db.for_user(user.id), user.id, path, fmt)
+
+        if not count:
+            await processing_msg.edit_text(
+                "📭 *В дневнике пока нет записей*",
+                parse_mode='Markdown'
+            )
+            return
+
+        with open(path, 'rb') as f:
+            await update.message.reply_document(
+                document=f,
+                filename=f'food_diary.{fmt}',
+                caption=f"📤 Выгружено записей: {count}",
+                reply_markup=create_main_keyboard()
+            )
+        try:
+            await processing_msg.delete()
+        except:
+            pass
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки: {e}")
+        await processing_msg.edit_text(
+            "❌ *Не удалось выгрузить дневник*",
+            parse_mode='Markdown'
+        )
+    finally:
+        os.remove(path)
+
+
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /import - ждем файл"""
+    context.user_data['awaiting_import'] = True
+    await update.message.reply_text(
+        "📥 *Загрузка дневника*\n\n"
+        "Отправьте файл `.csv` или `.jsonl` в формате /export.\n"
+        "Обязательное поле - `food_text`, остальные можно не указывать.",
+        parse_mode='Markdown',
+        reply_markup=create_main_keyboard()
+    )
+
+
+async def handle_import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик файла после /import (или файла с подписью /import)"""
+    caption = update.message.caption or ''
+    if not context.user_data.pop('awaiting_import', False) and not caption.startswith('/import'):
+        return
+
+    user = update.effective_user
+    document = update.message.document
+    fmt = detect_format(document.file_name)
+
+    processing_msg = await update.message.reply_text(
+        "📥 *Загружаю дневник...*",
+        parse_mode='Markdown'
+    )
+
+    fd, path = tempfile.mkstemp(suffix=f'.{fmt}')
+    os.close(fd)
+    try:
+        tg_file = await document.get_file()
+        await tg_file.download_to_drive(path)
+
+        imported, duplicates, skipped = await db.run(import_diary, db.db.for_user(user.id), user.id, path, fmt,
+                                         write=True, user_id=user.id)
+
+        response = f"✅ *Загружено записей:* `{imported}`"
+        if duplicates:
+            response += f"\nℹ️ Уже были в дневнике: `{duplicates}`"
+        if skipped:
+            response += f"\n⚠️ Пропущено некорректных строк: `{skipped}`"
+        await processing_msg.edit_text(response, parse_mode='Markdown')
+    except Exception as e:
+        logger.error(f"Ошибка загрузки: {e}")
+        await processing_msg.edit_text(
+            "❌ *Не удалось загрузить файл*\nПроверьте формат и попробуйте еще раз.",
+            parse_mode='Markdown'
+        )
+    finally:
+        os.remove(path)
+
+
+async def timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /timezone"""
+    user = update.effective_user
+
+    if not context.args:
+        tz = await db.user_timezone(user.id)
+        current = str(tz) if tz else "время сервера"
+        await update.message.reply_text(
+            f"🕒 *Ваш часовой пояс:* `{current}`\n\n"
+            "Чтобы изменить, укажите пояс:\n"
+            "• `/timezone Europe/Moscow`\n"
+            "• `/timezone Asia/Yekaterinburg`",
+            parse_mode='Markdown',
+            reply_markup=create_main_keyboard()
+        )
+        return
+
+    try:
+        await db.set_user_timezone(user.id, context.args[0])
+    except ValueError:
+        await update.message.reply_text(
+            "❌ *Неизвестный часовой пояс*\n\n"
+            "Пример: `/timezone Europe/Moscow`",
+            parse_mode='Markdown',
+            reply_markup=create_main_keyboard()
+        )
+        return
+
+    await update.message.reply_text(
+        f"✅ *Часовой пояс сохранен:* `{context.args[0]}`\n\n"
+        "Дни в статистике теперь считаются по вашему времени.",
+        parse_mode='Markdown',
+        reply_markup=create_main_keyboard()
+    )
+
+
+async def dbstats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /dbstats - файлы базы и статистика запросов (только для админов)"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+
+    files = format_maintenance_report(await db.run(maintenance.statuses))
+    files += "\n" + format_cache_stats(await nutrition_api.cache.stats_async())
+    report = await db.query_report()
+    if report is None:
+        report = "Инструментирование запросов выключено (DB_INSTRUMENT=1)"
+
+    # Без Markdown: в тексте SQL есть * и _
+    await update.message.reply_text(f"{files}\n\n{report}"[:4000])
+
+
+async def nutricache_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /nutricache [purge|clear] - кэш оценок КБЖУ (только для админов)"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+
+    action = context.args[0] if context.args else None
+    if action in ('purge', 'clear'):
+        # purge - только просроченные записи, clear - все
+        removed = await nutrition_api.cache.purge_async(everything=action == 'clear')
+        await update.message.reply_text(f"🗑 Удалено записей кэша: {removed}")
+        return
+
+    flights = nutrition_api.coalescing_stats()
+    await update.message.reply_text(
+        format_cache_stats(await nutrition_api.cache.stats_async()) +
+        f"\n🤝 Вызовов API: {flights['api_calls']}, "
+        f"объединено одинаковых запросов: {flights['coalesced_calls']} ({flights['saved_rate']:.0%})"
+    )
+
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик кнопки 'Помощь'"""
     await update.message.reply_text(
@@ -376,11 +642,15 @@ async def week_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
     # Получаем данные за неделю
-    week_data = db.get_week_summary(user.id)
+    week_data = await db.get_week_summary(user.id)
 
     # Форматируем ответ
     response = format_weekly_analysis(week_data)
 
+    # Сравнение с прошлыми неделями из недельных итогов
+    weeks_data = await db.get_weekly_totals(user.id)
+    response += format_weeks_comparison(weeks_data)
+
     # Добавляем аналитику, если есть данные
     if week_data and len(week_data) >= 3:
         try:
@@ -403,7 +673,7 @@ async def month_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
     # Получаем данные за месяц
-    month_data = db.get_month_summary(user.id)
+    month_data = await db.get_month_summary(user.id)
 
     # Форматируем ответ
     response = format_monthly_analysis(month_data)
@@ -420,7 +690,7 @@ async def show_chart(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
     # Получаем данные за неделю
-    week_data = db.get_week_summary(user.id)
+    week_data = await db.get_week_summary(user.id)
 
     if not week_data or len(week_data) < 2:
         await update.message.reply_text(
@@ -506,11 +776,48 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     return
 
+
+async def run_periodically(seconds, job, name):
+    """Фоновая задача: job в пуле потоков базы раз в seconds секунд"""
+    while True:
+        await asyncio.sleep(seconds)
+        try:
+            result = await db.run(job)
+        except Exception as e:
+            logger.error(f"Ошибка задачи '{name}': {e}")
+        else:
+            if name == 'maintenance':
+                logger.info(format_maintenance_report(result))
+
+
+async def post_init(application: Application):
+    """Запускаем фоновые задачи после старта бота"""
+    tasks = []
+    if BACKUP_INTERVAL_HOURS > 0:
+        tasks.append(asyncio.create_task(
+            run_periodically(BACKUP_INTERVAL_HOURS * 3600, DiaryBackup(db.db).backup, 'backup')
+        ))
+    if MAINTENANCE_INTERVAL_MINUTES > 0:
+        tasks.append(asyncio.create_task(
+            run_periodically(MAINTENANCE_INTERVAL_MINUTES * 60, maintenance.run, 'maintenance')
+        ))
+    application.bot_data['background_tasks'] = tasks
+
+
+async def shutdown(application: Application):
+    """Закрываем базу после остановки бота"""
+    for task in application.bot_data.get('background_tasks', []):
+        task.cancel()
+    await nutrition_api.aclose()
+    nutrition_api.cache.close()
+    await db.close()
+
+
 def main():
     """Запуск бота"""
 
     # Создаем приложение
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = Application.builder().token(TELEGRAM_TOKEN).post_init(post_init).post_shutdown(shutdown).build()
 
     # ConversationHandler для добавления еды
     conv_handler = ConversationHandler(
@@ -549,6 +856,15 @@ def main():
     application.add_handler(CommandHandler("week", week_stats))
     application.add_handler(CommandHandler("month", month_stats))
     application.add_handler(CommandHandler("chart", show_chart))
+    application.add_handler(CommandHandler("history", history_command))
+    application.add_handler(CallbackQueryHandler(history_callback, pattern='^h:'))
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("timezone", timezone_command))
+    application.add_handler(CommandHandler("dbstats", dbstats_command))
+    application.add_handler(CommandHandler("nutricache", nutricache_command))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler("import", import_command))
+    application.add_handler(MessageHandler(filters.Document.ALL, handle_import_file))
 
     # Обработчик всех остальных сообщений
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_other_messages))
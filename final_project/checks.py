@@ -0,0 +1,273 @@
+# checks.py
+"""Проверки корректности (замеры скорости - benchmarks.py).
+
+Запуск:
+    python checks.py              - все проверки
+    python checks.py split_meal quantities
+"""
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from database import Database
+from estimate_cache import EstimateCache
+from food_catalog import FoodCatalog
+from maintenance import DiaryMaintenance
+from openrouter_api import FUZZY_MIN_SIMILARITY, split_meal
+from quantities import food_weight
+from sharding import ShardedDatabase, stable_shard
+
+NUTRITION = {
+    'calories': 350,
+    'protein_g': 12.0,
+    'fat_g': 6.0,
+    'carbs_g': 60.0,
+    'advice': 'check'
+}
+
+
+def _check_cases(cases, actual, unit=''):
+    """Сравниваем результат с ожидаемым для каждого случая, печатаем расхождения"""
+    failed = 0
+    for case, expected in cases:
+        result = actual(case)
+        if result != expected:
+            failed += 1
+            print(f"❌ {case!r}: {result}{unit}, ожидалось {expected}")
+    print(f"🧪 Проверено сообщений: {len(cases)}, ошибок: {failed}")
+    return not failed
+
+
+def _crash_writer(path):
+    """Дочерний процесс: пишет без остановки и печатает id после подтверждения"""
+    db = Database(path, group_commit=True)
+    futures = []
+    user_id = 0
+    while True:
+        user_id += 1
+        futures.append(db.submit_food_entry(user_id % 100, 'гречка 200г', NUTRITION))
+        if len(futures) >= 32:
+            for future in futures:
+                print(future.result(), flush=True)
+            futures = []
+
+
+def check_crash_safety(seconds=2):
+    """Убиваем процесс посреди записи: каждый подтвержденный id должен быть в базе"""
+    workdir = tempfile.mkdtemp(prefix='food_crash_')
+    path = os.path.join(workdir, 'food_diary.db')
+
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '_crash_writer', path],
+        stdout=subprocess.PIPE,
+        text=True
+    )
+    time.sleep(seconds)
+    proc.send_signal(signal.SIGKILL)
+    output, _ = proc.communicate()
+
+    acked = {int(line) for line in output.split()}
+    conn = sqlite3.connect(path)
+    stored = {row[0] for row in conn.execute('SELECT id FROM food_entries')}
+    totals = conn.execute('SELECT SUM(total_calories) FROM daily_totals').fetchone()[0] or 0
+    entries = conn.execute('SELECT SUM(calories) FROM food_entries').fetchone()[0] or 0
+    conn.close()
+
+    lost = acked - stored
+    print(f"🧪 Подтверждено: {len(acked):,}, в базе: {len(stored):,}")
+    print(f"   потеряно подтвержденных: {len(lost)}")
+    print(f"   daily_totals совпадают с food_entries: {totals == entries}")
+    if lost or totals != entries:
+        return False
+    print("✅ Групповая запись переживает аварийное завершение")
+    return True
+
+
+def check_shard_move():
+    """Перенос пользователя с архивом на шард с незаархивированными записями того же года:
+    следующая архивация не должна перезаписать перенесенные записи"""
+    workdir = tempfile.mkdtemp(prefix='food_move_')
+    db = ShardedDatabase(2, workdir)
+    moved_user = next(user for user in range(1, 100) if stable_shard(user, 2) == 0)
+    other_user = next(user for user in range(1, 100) if stable_shard(user, 2) == 1)
+
+    for user_id in (moved_user, other_user):
+        for i in range(3):
+            db.add_food_entry(user_id, f'user {user_id} meal {i}', NUTRITION)
+        with db.shards[db.shard_index(user_id)].pool.writer() as conn:
+            conn.execute("UPDATE food_entries SET created_at = '2020-05-01 12:00:00' WHERE user_id = ?", (user_id,))
+
+    db.shards[0].archive.archive_old_entries()
+    db.move_user(moved_user, 1)
+    db.shards[1].archive.archive_old_entries()
+
+    target = db.shards[1]
+    with target.pool.reader() as conn:
+        with target.archive.attached(conn, 2020) as schema:
+            rows = conn.execute(f'SELECT user_id, food_text FROM {schema}.food_entries').fetchall()
+    db.close()
+
+    expected = {(user_id, f'user {user_id} meal {i}') for user_id in (moved_user, other_user) for i in range(3)}
+    print(f"🧪 В архиве 2020 целевого шарда: {len(rows)} записей, ожидалось {len(expected)}")
+    if set(rows) != expected or len(rows) != len(expected):
+        print("❌ Архивные записи перенесенного пользователя потеряны")
+        return False
+    print("✅ Перенос архива не пересекается с id целевого шарда")
+    return True
+
+
+def check_split_meal():
+    """Разбиение приема пищи на продукты: десятичная запятая и отдельный вес не дают продукта"""
+    cases = [
+        ('гречка 0,5 кг', ['гречка 0,5 кг']),
+        ('молоко 1,5 л', ['молоко 1,5 л']),
+        ('йогурт 2,5% 150 г', ['йогурт 2,5% 150 г']),
+        ('гречка 0,5 кг, молоко 1,5 л', ['гречка 0,5 кг', 'молоко 1,5 л']),
+        ('курица 150г,рис 100г', ['курица 150г', 'рис 100г']),
+        ('яблоко, кофе с молоком', ['яблоко', 'кофе', 'молоком']),
+        ('гречка, 150 гр', ['гречка 150 гр']),
+        ('Плов, 200 г', ['Плов 200 г']),
+        ('гречка; 200г', ['гречка 200г']),
+        ('яблоко 1 шт, 150 г', ['яблоко 1 шт 150 г']),
+        ('гречка, 150 гр, молоко 200 мл', ['гречка 150 гр', 'молоко 200 мл']),
+        ('200 г, гречка', ['200 г гречка']),
+    ]
+    if not _check_cases(cases, split_meal):
+        return False
+    print("✅ Продукты разделяются только настоящими разделителями")
+    return True
+
+
+def check_quantities():
+    """Вес порции из текста: проценты жирности и числа без единицы - не граммы"""
+    cases = [
+        (('творог 5% 200г', None), 200),
+        (('кефир 1% 250 мл', None), 250),
+        (('молоко 3.2% 200 мл', None), 200),
+        (('йогурт 2,5% 150 г', None), 150),
+        (('гречка 0,5 кг', None), 500),
+        (('кефир 1', None), 100),
+        (('250 гречки', None), 250),
+        (('2 яйца', {'piece': 55}), 110),
+        (('2 яйца 120 г', {'piece': 55}), 120),
+    ]
+    if not _check_cases(cases, lambda case: food_weight(*case), ' г'):
+        return False
+    print("✅ Вес порции считается только по количествам")
+    return True
+
+
+def check_catalog_match():
+    """Точный поиск: продукт после "без" и прилагательное от продукта - не продукт"""
+    catalog = FoodCatalog.load()
+    cases = [
+        ('кофе без сахара', ('кофе', True)),
+        ('чай без добавления сахара и молока', ('чай', True)),
+        ('морковный торт', ('торт', True)),
+        ('кукурузные хлопья', None),
+        ('гречку 200 г', ('гречка', True)),
+        ('докторская колбаса', ('колбаса вареная', True)),
+        ('докторская нарезка', ('колбаса вареная', False)),
+    ]
+
+    def match(text):
+        found = catalog.match_head(text)
+        return found and (found[0], found[2])
+
+    if not _check_cases(cases, match):
+        return False
+    print("✅ В справочнике ищутся только съеденные продукты")
+    return True
+
+
+def check_fuzzy_match():
+    """Нечеткий поиск: опечатки находятся, общее прилагательное - не совпадение"""
+    catalog = FoodCatalog.load()
+    cases = [
+        ('курриная грудка', 'куриная грудка'),
+        ('курриной грудкой 200 г', 'куриная грудка'),
+        ('гречкаа', 'гречка'),
+        ('моркофь', 'морковь'),
+        ('тварог', 'творог'),
+        ('греческий салат', None),
+        ('куриные наггетсы', None),
+        ('свиная отбивная', None),
+        ('творожная запеканка', None),
+        ('кукурузные хлопья', None),
+    ]
+    if not _check_cases(cases, lambda text: (catalog.fuzzy_match(text, FUZZY_MIN_SIMILARITY) or (None,))[0]):
+        return False
+    print("✅ Похожим считается только название, совпавшее по всем словам")
+    return True
+
+
+def check_cache_eviction():
+    """Кэш оценок: блюдо, которое берется из памяти, не вытесняется из таблицы первым"""
+    cache = EstimateCache(':memory:', max_entries=3)
+    cache.put('гречка', NUTRITION)
+    time.sleep(0.01)
+    for key in ('рис', 'овсянка'):
+        cache.put(key, NUTRITION)
+    time.sleep(0.01)
+    # Попадание в память, таблицу не трогает до следующей записи
+    cache.get('гречка')
+    cache.put('творог', NUTRITION)
+    with cache._lock:
+        cache._evict()
+        kept = {row[0] for row in cache.conn.execute('SELECT key FROM estimate_cache')}
+    cache.close()
+
+    print(f"🧪 В таблице после вытеснения: {', '.join(sorted(kept))}")
+    if 'гречка' not in kept:
+        print("❌ Часто используемое блюдо вытеснено")
+        return False
+    print("✅ Попадания в память продлевают жизнь записи в таблице")
+    return True
+
+
+def check_maintenance():
+    """Обслуживание: после vacuum в том же проходе делается TRUNCATE checkpoint"""
+    workdir = tempfile.mkdtemp(prefix='food_maintenance_')
+    db = Database(os.path.join(workdir, 'food_diary.db'))
+    for user_id in range(300):
+        db.add_food_entry(user_id, 'гречка ' * 200, NUTRITION)
+    with db.pool.writer() as conn:
+        conn.execute('DELETE FROM food_entries')
+    time.sleep(1.1)
+
+    status = DiaryMaintenance(db, quiet_seconds=1).run()[0]
+    db.close()
+
+    print(f"🧪 Освобождено страниц: {status['freed_pages']}, checkpoint: {status['checkpoint']}")
+    if not status['freed_pages'] or status['checkpoint'] != 'truncated':
+        print("❌ Vacuum прервал затишье, WAL не обрезан")
+        return False
+    print("✅ Служебные записи не мешают checkpoint")
+    return True
+
+
+CHECKS = {
+    'crash_safety': check_crash_safety,
+    'shard_move': check_shard_move,
+    'split_meal': check_split_meal,
+    'quantities': check_quantities,
+    'catalog_match': check_catalog_match,
+    'fuzzy_match': check_fuzzy_match,
+    'cache_eviction': check_cache_eviction,
+    'maintenance': check_maintenance,
+}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '_crash_writer':
+        _crash_writer(sys.argv[2])
+    else:
+        names = sys.argv[1:] or list(CHECKS)
+        failed = [name for name in names if not CHECKS[name]()]
+        if failed:
+            print(f"❌ Не прошли: {', '.join(failed)}")
+            sys.exit(1)
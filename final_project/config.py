@@ -17,4 +17,6 @@ if not TELEGRAM_TOKEN:
 # OpenRouter API ключ
 if not OPENROUTER_API_KEY:
     print("⚠️  Предупреждение: OPENROUTER_API_KEY не найден в .env файле!")
-    print("   Бот будет использовать локальную базу данных")
\ No newline at end of file
+    print("   Бот будет использовать локальную базу данных")
+# Администраторы бота (служебные команды вроде /dbstats), через запятую
+ADMIN_IDS = {int(x) for x in os.getenv('ADMIN_IDS', '').split(',') if x.strip()}
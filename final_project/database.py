@@ -1,14 +1,331 @@
 #database.py
+import functools
+import os
+import queue
+import re
 import sqlite3
-from datetime import datetime, timedelta
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from archive import ARCHIVE_DIR, DiaryArchiver
+from food_terms import extract_food_terms
+from food_text import ENDINGS, stem
+from instrumentation import INSTRUMENT, InstrumentedConnection, QueryStats
+from report_cache import ReportCache
+
+DB_PATH = os.getenv('FOOD_DIARY_DB', 'data/food_diary.db')
+
+# Настройки SQLite
+READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', '4'))
+MMAP_SIZE = 256 * 1024 * 1024      # 256 МБ отображаем в память
+CACHE_SIZE_KB = 64 * 1024          # 64 МБ кэша страниц на соединение
+BUSY_TIMEOUT_MS = 5000
+# После checkpoint файл WAL обрезается до этого размера
+JOURNAL_SIZE_LIMIT = 64 * 1024 * 1024
+
+# Версия схемы хранится в PRAGMA user_version
+SCHEMA_VERSION = 8
+
+# Размер порции при удалении дублей daily_totals (строк за транзакцию)
+DEDUP_CHUNK_SIZE = 10_000
+
+# Размер порции при заполнении food_entries.local_day
+BACKFILL_CHUNK_SIZE = 10_000
+
+# Групповая запись: сброс очереди раз в N мс или по набору N строк
+GROUP_COMMIT = os.getenv('DB_GROUP_COMMIT', '0') == '1'
+GROUP_COMMIT_MAX_ROWS = 256
+GROUP_COMMIT_MAX_DELAY_MS = 2
+
+# Записей на странице /history
+HISTORY_PAGE_SIZE = 10
+
+SEARCH_LIMIT = 20
+
+# Кэш отчетов (сегодня/неделя/месяц), записей
+REPORT_CACHE_SIZE = int(os.getenv('REPORT_CACHE_SIZE', '10000'))
+
+
+def cached_report(report):
+    """Кэширует отчет пользователя за текущий день до его следующей записи"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, user_id, *args, **kwargs):
+            key = (report,) + args + tuple(sorted(kwargs.items()))
+            day = self.local_now(user_id).strftime('%Y-%m-%d')
+            return self.cache.get_or_load(
+                user_id, key, day,
+                lambda: method(self, user_id, *args, **kwargs)
+            )
+        return wrapper
+    return decorator
+
+
+class ConnectionManager:
+    """Одно соединение для записи и пул соединений только для чтения"""
+
+    def __init__(self, path=DB_PATH, pool_size=READ_POOL_SIZE, synchronous='NORMAL', stats=None):
+        self.path = path
+        self.pool_size = pool_size
+        self.synchronous = synchronous
+        # QueryStats, если включено инструментирование (иначе None - без замеров)
+        self.stats = stats
+        self._write_lock = threading.RLock()
+        self._readers = queue.Queue()
+        self._readers_created = 0
+        self._readers_lock = threading.Lock()
+        # Время последней записи - обслуживание ждет затишья (maintenance.py)
+        self.last_write = time.monotonic()
+
+        # Писатель открывается первым: он создает файл и включает WAL.
+        # auto_vacuum применяется только к новой базе и только до WAL
+        self.writer_conn = self._connect(path)
+        self._apply_pragmas(self.writer_conn)
+        self.writer_conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        self.writer_conn.execute('PRAGMA journal_mode=WAL')
+        self.writer_conn.execute(f'PRAGMA journal_size_limit={JOURNAL_SIZE_LIMIT}')
+
+        # База в памяти не видна другим соединениям - читаем через писателя
+        self._shared = path == ':memory:'
+
+    def _apply_pragmas(self, conn):
+        conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+        conn.execute(f'PRAGMA cache_size=-{CACHE_SIZE_KB}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+
+    def _connect(self, target, **kwargs):
+        if self.stats is None:
+            return sqlite3.connect(target, check_same_thread=False, **kwargs)
+
+        conn = sqlite3.connect(target, check_same_thread=False,
+                               factory=InstrumentedConnection, **kwargs)
+        conn.stats = self.stats
+        return conn
+
+    def _open_reader(self):
+        conn = self._connect(f'file:{self.path}?mode=ro', uri=True)
+        self._apply_pragmas(conn)
+        return conn
+
+    def _acquire_reader(self):
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._readers_lock:
+            if self._readers_created < self.pool_size:
+                self._readers_created += 1
+                try:
+                    return self._open_reader()
+                except Exception:
+                    self._readers_created -= 1
+                    raise
+
+        # Все соединения заняты - ждем освободившееся
+        return self._readers.get()
+
+    @contextmanager
+    def _timed_write_lock(self):
+        """Блокировка писателя с замером ожидания"""
+        if self.stats is None:
+            with self._write_lock:
+                yield
+            return
+
+        start = time.perf_counter()
+        with self._write_lock:
+            self.stats.record_wait('writer_lock', (time.perf_counter() - start) * 1000)
+            yield
+
+    @contextmanager
+    def writer(self, touch=True):
+        """Транзакция на запись: commit при успехе, rollback при ошибке.
+
+        touch=False - служебная запись (maintenance.py), которая не
+        сбрасывает затишье: last_write отмечает только записи данных.
+        """
+        with self._timed_write_lock():
+            try:
+                yield self.writer_conn
+                self.writer_conn.commit()
+            except Exception:
+                self.writer_conn.rollback()
+                raise
+            finally:
+                if touch:
+                    self.last_write = time.monotonic()
+
+    @contextmanager
+    def reader(self):
+        """Соединение только для чтения из пула"""
+        if self._shared:
+            with self._timed_write_lock():
+                yield self.writer_conn
+            return
+
+        if self.stats is None:
+            conn = self._acquire_reader()
+        else:
+            start = time.perf_counter()
+            conn = self._acquire_reader()
+            self.stats.record_wait('reader_pool', (time.perf_counter() - start) * 1000)
+        try:
+            yield conn
+        finally:
+            # Закрываем неявную транзакцию чтения, чтобы не держать снимок WAL
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._write_lock:
+            self.writer_conn.close()
+
+
+class WriteBatcher:
+    """Групповая запись приемов пищи.
+
+    Записи из разных потоков копятся в очереди и сбрасываются одной
+    транзакцией (один fsync) каждые max_delay_ms или по max_rows строк.
+    submit() возвращает Future, который получает id записи только после
+    commit, то есть после того, как запись надежно сохранена.
+    """
+
+    _STOP = object()
+
+    def __init__(self, db, max_rows=GROUP_COMMIT_MAX_ROWS, max_delay_ms=GROUP_COMMIT_MAX_DELAY_MS):
+        self.db = db
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='db-group-commit', daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id, food_text, nutrition_data):
+        if self._closed:
+            raise RuntimeError('WriteBatcher закрыт')
+        future = Future()
+        self._queue.put((future, (user_id, food_text, nutrition_data)))
+        return future
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_rows:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._flush(batch)
+
+    def _flush(self, batch):
+        results = []
+        try:
+            with self.db.pool.writer() as conn:
+                conn.execute('BEGIN')
+                for future, args in batch:
+                    # Ошибка одной записи не должна откатывать всю пачку
+                    conn.execute('SAVEPOINT meal')
+                    try:
+                        entry_id = self.db._insert_food_entry(conn, *args)
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO meal')
+                        results.append((future, args[0], None, e))
+                    else:
+                        results.append((future, args[0], entry_id, None))
+                    conn.execute('RELEASE meal')
+        except Exception as e:
+            # Не удался сам commit - ни одна запись не сохранена
+            for future, _ in batch:
+                future.set_exception(e)
+            return
+
+        # Кэш отчетов сбрасываем после commit и до подтверждения вызывающим
+        for _, user_id, _, error in results:
+            if error is None:
+                self.db.cache.invalidate(user_id)
+
+        for future, _, entry_id, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(entry_id)
+
+    def close(self):
+        """Сбрасываем все, что осталось в очереди, и останавливаем поток"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(self._STOP)
+        self._thread.join()
+
 
 class Database:
-    def __init__(self):
-        self.conn = sqlite3.connect('data/food_diary.db', check_same_thread=False)
+    # Один файл - один шард (см. ShardedDatabase в sharding.py)
+    shard_count = 1
+
+    def __init__(self, path=DB_PATH, pool_size=READ_POOL_SIZE, group_commit=GROUP_COMMIT,
+                 synchronous=None, archive_dir=ARCHIVE_DIR, instrument=INSTRUMENT, query_stats=None):
+        # Групповая запись подтверждает сохранность, поэтому fsync на каждый
+        # commit (FULL) - его цена делится на всю пачку
+        if synchronous is None:
+            synchronous = 'FULL' if group_commit else 'NORMAL'
+        if instrument and query_stats is None:
+            query_stats = QueryStats()
+        self.pool = ConnectionManager(path, pool_size, synchronous, query_stats)
+        self.cache = ReportCache(REPORT_CACHE_SIZE)
+        self._timezones = {}
+        self.archive = DiaryArchiver(self, archive_dir)
+        # Для совместимости: self.conn - соединение писателя
+        self.conn = self.pool.writer_conn
         self.create_tables()
+        self.batcher = WriteBatcher(self) if group_commit else None
+
+    def for_user(self, user_id):
+        """База, в которой хранятся данные пользователя"""
+        return self
+
+    def shard_index(self, user_id):
+        return 0
+
+    def database_files(self):
+        """Файлы SQLite с горячими данными (для резервного копирования)"""
+        return [] if self.pool.path == ':memory:' else [self.pool.path]
 
     def create_tables(self):
-        cursor = self.conn.cursor()
+        with self.pool.writer() as conn:
+            self._create_tables(conn)
+            self._migrate(conn)
+
+    def _create_tables(self, conn):
+        cursor = conn.cursor()
 
         # Таблица пользователей
         cursor.execute('''
@@ -16,7 +333,8 @@ class Database:
             user_id INTEGER PRIMARY KEY,
             username TEXT,
             first_name TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            timezone TEXT
         )
         ''')
 
@@ -32,6 +350,7 @@ class Database:
             carbs_g REAL,
             advice TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            local_day INTEGER,
             FOREIGN KEY (user_id) REFERENCES users (user_id)
         )
         ''')
@@ -50,25 +369,324 @@ class Database:
         )
         ''')
 
-        self.conn.commit()
+        # Недельные и месячные итоги, обновляются вместе с daily_totals
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS weekly_totals (
+            user_id INTEGER,
+            week_start DATE,
+            total_calories INTEGER DEFAULT 0,
+            total_protein REAL DEFAULT 0,
+            total_fat REAL DEFAULT 0,
+            total_carbs REAL DEFAULT 0,
+            days_count INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, week_start)
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_totals (
+            user_id INTEGER,
+            month TEXT,
+            total_calories INTEGER DEFAULT 0,
+            total_protein REAL DEFAULT 0,
+            total_fat REAL DEFAULT 0,
+            total_carbs REAL DEFAULT 0,
+            days_count INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, month)
+        )
+        ''')
+
+        # Сколько приемов пищи пользователя содержали продукт (вся история)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_food_terms (
+            user_id INTEGER,
+            term TEXT,
+            word TEXT,
+            count INTEGER DEFAULT 0,
+            last_seen TIMESTAMP,
+            PRIMARY KEY (user_id, term)
+        ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_food_terms_top
+        ON user_food_terms (user_id, count DESC, last_seen DESC)
+        ''')
+
+    def _migrate(self, conn):
+        """Автоматические миграции для уже существующих баз"""
+        # Версия поднимается после каждого шага, прерванная миграция продолжится
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+
+        if version < 1:
+            # Индекс для выборок записей пользователя по времени
+            conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_food_entries_user_created
+            ON food_entries (user_id, created_at)
+            ''')
+            self._set_schema_version(conn, 1)
+
+        if version < 2:
+            # Один день - одна строка итогов
+            self._dedup_daily_totals(conn)
+            conn.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_daily_totals_user_date
+            ON daily_totals (user_id, date)
+            ''')
+            conn.execute('DROP INDEX IF EXISTS idx_daily_totals_dedup')
+            self._set_schema_version(conn, 2)
+
+        if version < 3:
+            # Заполняем недельные и месячные итоги по истории
+            self._rebuild_rollups(conn)
+            self._set_schema_version(conn, 3)
+
+        if version < 4:
+            # Часовой пояс пользователя и локальный день записи (YYYYMMDD)
+            self._add_column(conn, 'users', 'timezone', 'TEXT')
+            self._add_column(conn, 'food_entries', 'local_day', 'INTEGER')
+            conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_food_entries_user_day
+            ON food_entries (user_id, local_day)
+            ''')
+            conn.commit()
+            self._backfill_local_day(conn)
+            self._set_schema_version(conn, 4)
+
+        if version < 5:
+            # Полнотекстовый поиск по food_text (внешнее содержимое - food_entries).
+            # user_id тоже проиндексирован, чтобы отбор по пользователю шел по индексу FTS
+            conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS food_entries_fts USING fts5(
+                user_id, food_text,
+                content='food_entries', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+            ''')
+            conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS food_entries_fts_insert AFTER INSERT ON food_entries BEGIN
+                INSERT INTO food_entries_fts (rowid, user_id, food_text)
+                VALUES (new.id, new.user_id, new.food_text);
+            END
+            ''')
+            conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS food_entries_fts_delete AFTER DELETE ON food_entries BEGIN
+                INSERT INTO food_entries_fts (food_entries_fts, rowid, user_id, food_text)
+                VALUES ('delete', old.id, old.user_id, old.food_text);
+            END
+            ''')
+            conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS food_entries_fts_update
+            AFTER UPDATE OF user_id, food_text ON food_entries BEGIN
+                INSERT INTO food_entries_fts (food_entries_fts, rowid, user_id, food_text)
+                VALUES ('delete', old.id, old.user_id, old.food_text);
+                INSERT INTO food_entries_fts (rowid, user_id, food_text)
+                VALUES (new.id, new.user_id, new.food_text);
+            END
+            ''')
+            # Индексируем уже существующие записи
+            conn.execute("INSERT INTO food_entries_fts (food_entries_fts) VALUES ('rebuild')")
+            self._set_schema_version(conn, 5)
+
+        if version < 6:
+            # Частоты продуктов по всей истории, включая архив
+            conn.commit()
+            self._rebuild_food_terms(conn)
+            self._set_schema_version(conn, 6)
+
+        if version < 7:
+            # Освобождение места по частям (PRAGMA incremental_vacuum).
+            # Для существующей базы режим включается только полным VACUUM - он
+            # блокирует базу и требует двойного места, поэтому не при запуске, а
+            # отдельной командой: python maintenance.py convert. До нее
+            # PRAGMA auto_vacuum != 2, и /dbstats показывает, что перевод не сделан
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                print("ℹ️  Освобождение места по частям не включено: python maintenance.py convert")
+            self._set_schema_version(conn, 7)
+
+        if version < 8:
+            # Продукты по основе слова и названию из справочника, word - форма для показа
+            self._add_column(conn, 'user_food_terms', 'word', 'TEXT')
+            conn.commit()
+            self._rebuild_food_terms(conn)
+            self._set_schema_version(conn, 8)
+
+    def _add_column(self, conn, table, column, declaration):
+        columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        if column not in columns:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+
+    def _set_schema_version(self, conn, version):
+        conn.execute(f'PRAGMA user_version = {version}')
+        conn.commit()
+
+    def _dedup_daily_totals(self, conn, chunk_size=DEDUP_CHUNK_SIZE):
+        """Схлопываем дубли (user_id, date) в daily_totals порциями.
+
+        Раньше каждый прием пищи добавлял новую пустую строку, а UPDATE
+        прибавлял еду ко всем строкам дня. Поэтому самая ранняя строка
+        (минимальный id) содержит полную сумму, остальные удаляем.
+        """
+        # Вспомогательный индекс, чтобы поиск "старшего" дубля не сканировал таблицу
+        conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_daily_totals_dedup
+        ON daily_totals (user_id, date, id)
+        ''')
+        conn.commit()
+
+        max_id = conn.execute('SELECT MAX(id) FROM daily_totals').fetchone()[0]
+        if max_id is None:
+            return
+
+        removed = 0
+        for chunk_start in range(0, max_id + 1, chunk_size):
+            # Каждая порция - отдельная короткая транзакция
+            cursor = conn.execute('''
+            DELETE FROM daily_totals
+            WHERE id >= ? AND id < ?
+              AND EXISTS (
+                SELECT 1 FROM daily_totals AS older
+                WHERE older.user_id = daily_totals.user_id
+                  AND older.date = daily_totals.date
+                  AND older.id < daily_totals.id
+              )
+            ''', (chunk_start, chunk_start + chunk_size))
+            conn.commit()
+            removed += cursor.rowcount
+
+        if removed:
+            print(f"🧹 Удалено дублей daily_totals: {removed}")
+
+    def _backfill_local_day(self, conn, chunk_size=BACKFILL_CHUNK_SIZE):
+        """Заполняем local_day у старых записей порциями по id.
+
+        created_at хранится в UTC (CURRENT_TIMESTAMP), переводим его в
+        часовой пояс пользователя. Можно прервать и запустить снова.
+        """
+        last_id = 0
+        filled = 0
+        while True:
+            rows = conn.execute('''
+            SELECT id, user_id, created_at FROM food_entries
+            WHERE id > ? AND local_day IS NULL
+            ORDER BY id
+            LIMIT ?
+            ''', (last_id, chunk_size)).fetchall()
+            if not rows:
+                break
+
+            updates = []
+            for entry_id, user_id, created_at in rows:
+                moment = datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+                updates.append((self._to_local_day(moment.astimezone(self.user_timezone(user_id))), entry_id))
+
+            conn.executemany('UPDATE food_entries SET local_day = ? WHERE id = ?', updates)
+            conn.commit()
+            filled += len(updates)
+            last_id = rows[-1][0]
+
+        if filled:
+            print(f"🕒 Заполнен local_day для записей: {filled}")
+
+    def backfill_local_day(self):
+        """Задание для ручного запуска: заполнить local_day у старых записей"""
+        with self.pool.writer() as conn:
+            self._backfill_local_day(conn)
+        self.cache.clear()
+
+    @staticmethod
+    def _to_local_day(moment):
+        return int(moment.strftime('%Y%m%d'))
+
+    def user_timezone(self, user_id):
+        """Часовой пояс пользователя (None - локальное время сервера)"""
+        if user_id in self._timezones:
+            return self._timezones[user_id]
+
+        with self.pool.reader() as conn:
+            row = conn.execute(
+                'SELECT timezone FROM users WHERE user_id = ?', (user_id,)
+            ).fetchone()
+
+        tz = None
+        if row and row[0]:
+            try:
+                tz = ZoneInfo(row[0])
+            except (ZoneInfoNotFoundError, ValueError):
+                tz = None
+        self._timezones[user_id] = tz
+        return tz
+
+    def local_now(self, user_id):
+        """Текущее время в часовом поясе пользователя (без tzinfo)"""
+        tz = self.user_timezone(user_id)
+        if tz is None:
+            return datetime.now()
+        return datetime.now(tz).replace(tzinfo=None)
+
+    def set_user_timezone(self, user_id, tz_name):
+        """Сохраняем часовой пояс (IANA, например Europe/Moscow)"""
+        try:
+            tz = ZoneInfo(tz_name)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Неизвестный часовой пояс: {tz_name}")
+
+        with self.pool.writer() as conn:
+            conn.execute('''
+            INSERT INTO users (user_id, timezone) VALUES (?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET timezone = excluded.timezone
+            ''', (user_id, tz_name))
+
+        self._timezones[user_id] = tz
+        self.cache.invalidate(user_id)
 
     def add_user(self, user_id, username, first_name):
         """Добавляем пользователя в БД"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-        INSERT OR IGNORE INTO users (user_id, username, first_name) 
-        VALUES (?, ?, ?)
-        ''', (user_id, username, first_name))
-        self.conn.commit()
+        with self.pool.writer() as conn:
+            conn.execute('''
+            INSERT INTO users (user_id, username, first_name) 
+            VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET 
+                username = excluded.username,
+                first_name = excluded.first_name
+            ''', (user_id, username, first_name))
 
     def add_food_entry(self, user_id, food_text, nutrition_data):
         """Добавляем запись о приеме пищи"""
-        cursor = self.conn.cursor()
+        if self.batcher:
+            # Ждем commit пачки, в которую попала запись
+            return self.batcher.submit(user_id, food_text, nutrition_data).result()
+
+        with self.pool.writer() as conn:
+            entry_id = self._insert_food_entry(conn, user_id, food_text, nutrition_data)
+
+        # Версию поднимаем только после commit
+        self.cache.invalidate(user_id)
+        return entry_id
+
+    def submit_food_entry(self, user_id, food_text, nutrition_data):
+        """Ставим запись в очередь групповой записи, возвращаем Future с id"""
+        if self.batcher:
+            return self.batcher.submit(user_id, food_text, nutrition_data)
+
+        future = Future()
+        try:
+            future.set_result(self.add_food_entry(user_id, food_text, nutrition_data))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _insert_food_entry(self, conn, user_id, food_text, nutrition_data):
+        """Запись приема пищи и дневных итогов внутри открытой транзакции"""
+        cursor = conn.cursor()
+
+        # День считаем один раз при вставке - в часовом поясе пользователя
+        now = self.local_now(user_id)
+        today = now.strftime('%Y-%m-%d')
 
         cursor.execute('''
         INSERT INTO food_entries 
-        (user_id, food_text, calories, protein_g, fat_g, carbs_g, advice)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
+        (user_id, food_text, calories, protein_g, fat_g, carbs_g, advice, local_day)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             user_id,
             food_text,
@@ -76,134 +694,474 @@ class Database:
             nutrition_data['protein_g'],
             nutrition_data['fat_g'],
             nutrition_data['carbs_g'],
-            nutrition_data['advice']
+            nutrition_data['advice'],
+            self._to_local_day(now)
         ))
+        entry_id = cursor.lastrowid
 
-        # Обновляем дневные итоги
-        today = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute('''
-        INSERT OR IGNORE INTO daily_totals (user_id, date) 
-        VALUES (?, ?)
-        ''', (user_id, today))
+        # Первая запись за день увеличивает счетчик дней в недельных/месячных итогах
+        new_day = cursor.execute('''
+        SELECT 1 FROM daily_totals WHERE user_id = ? AND date = ?
+        ''', (user_id, today)).fetchone() is None
 
+        # Обновляем дневные итоги одним UPSERT
         cursor.execute('''
-        UPDATE daily_totals 
-        SET 
-            total_calories = total_calories + ?,
-            total_protein = total_protein + ?,
-            total_fat = total_fat + ?,
-            total_carbs = total_carbs + ?
-        WHERE user_id = ? AND date = ?
+        INSERT INTO daily_totals 
+        (user_id, date, total_calories, total_protein, total_fat, total_carbs)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, date) DO UPDATE SET 
+            total_calories = total_calories + excluded.total_calories,
+            total_protein = total_protein + excluded.total_protein,
+            total_fat = total_fat + excluded.total_fat,
+            total_carbs = total_carbs + excluded.total_carbs
         ''', (
+            user_id,
+            today,
             nutrition_data['calories'],
             nutrition_data['protein_g'],
             nutrition_data['fat_g'],
-            nutrition_data['carbs_g'],
+            nutrition_data['carbs_g']
+        ))
+
+        self._add_food_terms(cursor, user_id, food_text)
+
+        week_start = (now - timedelta(days=now.weekday())).strftime('%Y-%m-%d')
+        self._add_to_rollup(cursor, 'weekly_totals', 'week_start', week_start,
+                            user_id, nutrition_data, new_day)
+        self._add_to_rollup(cursor, 'monthly_totals', 'month', now.strftime('%Y-%m'),
+                            user_id, nutrition_data, new_day)
+
+        return entry_id
+
+    def _add_to_rollup(self, cursor, table, period_column, period, user_id, nutrition_data, new_day):
+        """UPSERT в weekly_totals / monthly_totals"""
+        cursor.execute(f'''
+        INSERT INTO {table} 
+        (user_id, {period_column}, total_calories, total_protein, total_fat, total_carbs, days_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, {period_column}) DO UPDATE SET 
+            total_calories = total_calories + excluded.total_calories,
+            total_protein = total_protein + excluded.total_protein,
+            total_fat = total_fat + excluded.total_fat,
+            total_carbs = total_carbs + excluded.total_carbs,
+            days_count = days_count + excluded.days_count
+        ''', (
             user_id,
-            today
+            period,
+            nutrition_data['calories'],
+            nutrition_data['protein_g'],
+            nutrition_data['fat_g'],
+            nutrition_data['carbs_g'],
+            int(new_day)
+        ))
+
+    def _add_food_terms(self, conn, user_id, food_text, seen_at=None):
+        """Учитываем продукты приема пищи в user_food_terms"""
+        conn.executemany('''
+        INSERT INTO user_food_terms (user_id, term, word, count, last_seen)
+        VALUES (?, ?, ?, 1, COALESCE(?, CURRENT_TIMESTAMP))
+        ON CONFLICT (user_id, term) DO UPDATE SET
+            count = count + 1,
+            last_seen = MAX(last_seen, excluded.last_seen)
+        ''', ((user_id, term, word, seen_at) for term, word in extract_food_terms(food_text)))
+
+    def _rebuild_food_terms(self, conn, user_id=None, chunk_size=BACKFILL_CHUNK_SIZE):
+        """Пересчитываем user_food_terms по горячей базе и архивам"""
+        where = '' if user_id is None else 'AND user_id = ?'
+        params = () if user_id is None else (user_id,)
+        terms = {}
+
+        def scan(table):
+            last_id = -1
+            while True:
+                rows = conn.execute(f'''
+                SELECT id, user_id, food_text, created_at FROM {table}
+                WHERE id > ? {where}
+                ORDER BY id
+                LIMIT ?
+                ''', (last_id, *params, chunk_size)).fetchall()
+                if not rows:
+                    break
+                for _, entry_user, food_text, created_at in rows:
+                    for term, word in extract_food_terms(food_text):
+                        item = terms.setdefault((entry_user, term), [0, created_at, word])
+                        item[0] += 1
+                        item[1] = max(item[1], created_at)
+                last_id = rows[-1][0]
+
+        for year in self.archive.years():
+            with self.archive.attached(conn, year) as schema:
+                scan(f'{schema}.food_entries')
+        scan('main.food_entries')
+
+        conn.execute(f'DELETE FROM user_food_terms WHERE 1 {where}', params)
+        conn.executemany('''
+        INSERT INTO user_food_terms (user_id, term, word, count, last_seen) VALUES (?, ?, ?, ?, ?)
+        ''', (
+            (entry_user, term, word, count, last_seen)
+            for (entry_user, term), (count, last_seen, word) in terms.items()
         ))
+        conn.commit()
+
+    def rebuild_food_terms(self, user_id=None):
+        """Задание для ручного запуска: пересчитать частоты продуктов"""
+        with self.pool.writer() as conn:
+            if conn.in_transaction:
+                conn.commit()
+            self._rebuild_food_terms(conn, user_id)
+
+        if user_id is None:
+            self.cache.clear()
+        else:
+            self.cache.invalidate(user_id)
+
+    def rebuild_rollups(self, user_id=None):
+        """Пересчитываем недельные и месячные итоги из daily_totals"""
+        with self.pool.writer() as conn:
+            self._rebuild_rollups(conn, user_id)
+
+        if user_id is None:
+            self.cache.clear()
+        else:
+            self.cache.invalidate(user_id)
+
+    def cache_stats(self):
+        """Попадания и промахи кэша отчетов"""
+        return self.cache.stats()
+
+    def query_stats(self):
+        """Снимок статистики запросов (None, если инструментирование выключено)"""
+        if self.pool.stats is None:
+            return None
+        return self.pool.stats.snapshot()
+
+    def query_report(self, top=10):
+        """Текстовый отчет по самым затратным запросам"""
+        if self.pool.stats is None:
+            return None
+        return self.pool.stats.report(top)
+
+    def get_global_stats(self):
+        """Общая статистика по всем пользователям (для администратора)"""
+        with self.pool.reader() as conn:
+            users, entries, days = conn.execute('''
+            SELECT 
+                (SELECT COUNT(*) FROM users),
+                (SELECT COUNT(*) FROM food_entries),
+                (SELECT COUNT(*) FROM daily_totals)
+            ''').fetchone()
+        return {'users': users, 'entries': entries, 'days': days}
 
-        self.conn.commit()
-        return cursor.lastrowid
+    def _rebuild_rollups(self, conn, user_id=None):
+        where = 'WHERE user_id = ?' if user_id is not None else ''
+        params = (user_id,) if user_id is not None else ()
 
+        # Понедельник недели: ближайшее воскресенье (или тот же день) минус 6 дней
+        periods = {
+            'weekly_totals': ('week_start', "date(date, 'weekday 0', '-6 days')"),
+            'monthly_totals': ('month', "strftime('%Y-%m', date)"),
+        }
+
+        for table, (period_column, period_expr) in periods.items():
+            conn.execute(f'DELETE FROM {table} {where}', params)
+            conn.execute(f'''
+            INSERT INTO {table} 
+            (user_id, {period_column}, total_calories, total_protein, total_fat, total_carbs, days_count)
+            SELECT 
+                user_id,
+                {period_expr},
+                SUM(total_calories),
+                SUM(total_protein),
+                SUM(total_fat),
+                SUM(total_carbs),
+                COUNT(*)
+            FROM daily_totals 
+            {where}
+            GROUP BY user_id, {period_expr}
+            ''', params)
+
+    @cached_report('today_summary')
     def get_today_summary(self, user_id):
         """Получаем итоги за сегодня"""
-        cursor = self.conn.cursor()
-        today = datetime.now().strftime('%Y-%m-%d')
-
-        cursor.execute('''
-        SELECT * FROM daily_totals 
-        WHERE user_id = ? AND date = ?
-        ''', (user_id, today))
+        today = self.local_now(user_id).strftime('%Y-%m-%d')
 
-        result = cursor.fetchone()
+        with self.pool.reader() as conn:
+            result = conn.execute('''
+            SELECT total_calories, total_protein, total_fat, total_carbs
+            FROM daily_totals 
+            WHERE user_id = ? AND date = ?
+            ''', (user_id, today)).fetchone()
 
         if result:
             return {
-                'total_calories': result[3],
-                'total_protein': result[4],
-                'total_fat': result[5],
-                'total_carbs': result[6]
+                'total_calories': result[0],
+                'total_protein': result[1],
+                'total_fat': result[2],
+                'total_carbs': result[3]
             }
         return None
 
+    @cached_report('today_entries')
     def get_today_entries(self, user_id):
-        """Получаем все записи за сегодня"""
-        cursor = self.conn.cursor()
-        today = datetime.now().strftime('%Y-%m-%d')
+        """Получаем все записи за сегодня (время - в часовом поясе пользователя)"""
+        today = self._to_local_day(self.local_now(user_id))
 
-        cursor.execute('''
-        SELECT food_text, calories, protein_g, fat_g, carbs_g, advice, created_at
-        FROM food_entries 
-        WHERE user_id = ? AND DATE(created_at) = ?
-        ORDER BY created_at
-        ''', (user_id, today))
+        with self.pool.reader() as conn:
+            rows = conn.execute('''
+            SELECT food_text, calories, protein_g, fat_g, carbs_g, advice, created_at
+            FROM food_entries 
+            WHERE user_id = ? AND local_day = ?
+            ORDER BY created_at
+            ''', (user_id, today)).fetchall()
+
+        tz = self.user_timezone(user_id)
+        return [row[:6] + (self._utc_to_local(row[6], tz),) for row in rows]
 
-        return cursor.fetchall()
+    @staticmethod
+    def _utc_to_local(created_at, tz):
+        """created_at (UTC) -> строка в часовом поясе пользователя"""
+        moment = datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+        return moment.astimezone(tz).strftime('%Y-%m-%d %H:%M:%S')
 
+    @cached_report('week')
     def get_week_summary(self, user_id):
         """Получаем статистику за 7 дней"""
-        cursor = self.conn.cursor()
+        # Полуинтервал [7 дней назад, завтра)
+        now = self.local_now(user_id)
+        seven_days_ago = (now - timedelta(days=7)).strftime('%Y-%m-%d')
+        tomorrow = (now + timedelta(days=1)).strftime('%Y-%m-%d')
 
-        # Дата 7 дней назад
-        seven_days_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-
-        cursor.execute('''
-        SELECT 
-            date,
-            total_calories,
-            total_protein,
-            total_fat,
-            total_carbs
-        FROM daily_totals 
-        WHERE user_id = ? AND date >= ?
-        ORDER BY date
-        ''', (user_id, seven_days_ago))
-
-        return cursor.fetchall()
+        with self.pool.reader() as conn:
+            return conn.execute('''
+            SELECT 
+                date,
+                total_calories,
+                total_protein,
+                total_fat,
+                total_carbs
+            FROM daily_totals 
+            WHERE user_id = ? AND date >= ? AND date < ?
+            ORDER BY date
+            ''', (user_id, seven_days_ago, tomorrow)).fetchall()
 
+    @cached_report('month')
     def get_month_summary(self, user_id):
-        """Получаем статистику за 30 дней"""
-        cursor = self.conn.cursor()
+        """Получаем статистику по месяцам, затронутым последними 30 днями"""
+        # Месяц, в который попадает дата 30 дней назад
+        first_month = (self.local_now(user_id) - timedelta(days=30)).strftime('%Y-%m')
 
-        # Дата 30 дней назад
-        thirty_days_ago = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+        with self.pool.reader() as conn:
+            return conn.execute('''
+            SELECT 
+                month,
+                CAST(total_calories AS REAL) / days_count as avg_calories,
+                total_protein / days_count as avg_protein,
+                total_fat / days_count as avg_fat,
+                total_carbs / days_count as avg_carbs,
+                days_count
+            FROM monthly_totals 
+            WHERE user_id = ? AND month >= ? AND days_count > 0
+            ORDER BY month
+            ''', (user_id, first_month)).fetchall()
 
-        cursor.execute('''
-        SELECT 
-            strftime('%Y-%m', date) as month,
-            AVG(total_calories) as avg_calories,
-            AVG(total_protein) as avg_protein,
-            AVG(total_fat) as avg_fat,
-            AVG(total_carbs) as avg_carbs,
-            COUNT(*) as days_count
-        FROM daily_totals 
-        WHERE user_id = ? AND date >= ?
-        GROUP BY strftime('%Y-%m', date)
-        ORDER BY month
-        ''', (user_id, thirty_days_ago))
-
-        return cursor.fetchall()
-
-    def get_all_entries(self, user_id, limit=100):
-        """Получаем все записи пользователя"""
-        cursor = self.conn.cursor()
+    @cached_report('weeks')
+    def get_weekly_totals(self, user_id, weeks=4):
+        """Средние в день по последним неделям (с понедельника)"""
+        now = self.local_now(user_id)
+        first_week = (now - timedelta(days=now.weekday() + 7 * (weeks - 1))).strftime('%Y-%m-%d')
 
-        cursor.execute('''
-        SELECT 
-            food_text,
-            calories,
-            protein_g,
-            fat_g,
-            carbs_g,
-            created_at
-        FROM food_entries 
-        WHERE user_id = ?
-        ORDER BY created_at DESC
-        LIMIT ?
-        ''', (user_id, limit))
-
-        return cursor.fetchall()
+        with self.pool.reader() as conn:
+            return conn.execute('''
+            SELECT 
+                week_start,
+                CAST(total_calories AS REAL) / days_count as avg_calories,
+                total_protein / days_count as avg_protein,
+                total_fat / days_count as avg_fat,
+                total_carbs / days_count as avg_carbs,
+                days_count
+            FROM weekly_totals 
+            WHERE user_id = ? AND week_start >= ? AND days_count > 0
+            ORDER BY week_start
+            ''', (user_id, first_week)).fetchall()
+
+    @cached_report('food_stats')
+    def get_food_stats(self, user_id, top=5):
+        """Число записей и самые частые продукты за всю историю, включая архив"""
+        with self.pool.reader() as conn:
+            entries = conn.execute('''
+            SELECT COUNT(*) FROM food_entries WHERE user_id = ?
+            ''', (user_id,)).fetchone()[0]
+            entries += self.archive.count_entries(conn, user_id)
+
+            top_foods = conn.execute('''
+            SELECT COALESCE(word, term), count FROM user_food_terms
+            WHERE user_id = ?
+            ORDER BY count DESC, last_seen DESC
+            LIMIT ?
+            ''', (user_id, top)).fetchall()
+
+        return {'entries': entries, 'top_foods': top_foods}
+
+    def get_all_entries(self, user_id, limit=100, before=None, include_archive=False):
+        """Получаем все записи пользователя (before - записи строго раньше этого момента).
+
+        include_archive=True дочитывает старые записи из архивных файлов.
+        """
+        if before is None:
+            before = '9999-12-31 23:59:59'
+
+        with self.pool.reader() as conn:
+            entries = conn.execute('''
+            SELECT 
+                food_text,
+                calories,
+                protein_g,
+                fat_g,
+                carbs_g,
+                created_at
+            FROM food_entries 
+            WHERE user_id = ? AND created_at < ?
+            ORDER BY created_at DESC
+            LIMIT ?
+            ''', (user_id, before, limit)).fetchall()
+
+            # Архивные записи всегда старше горячих, дочитываем только недостающее
+            if include_archive and len(entries) < limit:
+                entries += self.archive.get_entries(conn, user_id, limit - len(entries), before)
+
+        return entries
+
+    def get_history_page(self, user_id, cursor=None, older=True, page_size=HISTORY_PAGE_SIZE):
+        """Страница истории приемов пищи, новые сначала.
+
+        Keyset-пагинация по (created_at, id): cursor - (created_at, id) крайней
+        записи предыдущей страницы, older - листать назад или вперед. Запрос
+        идет по индексу (user_id, created_at), поэтому любая страница стоит
+        столько же, сколько первая.
+        """
+        with self.pool.reader() as conn:
+            if cursor is None:
+                rows = conn.execute('''
+                SELECT id, food_text, calories, protein_g, fat_g, carbs_g, created_at
+                FROM food_entries 
+                WHERE user_id = ?
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+                ''', (user_id, page_size + 1)).fetchall()
+            elif older:
+                rows = conn.execute('''
+                SELECT id, food_text, calories, protein_g, fat_g, carbs_g, created_at
+                FROM food_entries 
+                WHERE user_id = ? AND (created_at, id) < (?, ?)
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+                ''', (user_id, cursor[0], cursor[1], page_size + 1)).fetchall()
+            else:
+                rows = conn.execute('''
+                SELECT id, food_text, calories, protein_g, fat_g, carbs_g, created_at
+                FROM food_entries 
+                WHERE user_id = ? AND (created_at, id) > (?, ?)
+                ORDER BY created_at, id
+                LIMIT ?
+                ''', (user_id, cursor[0], cursor[1], page_size + 1)).fetchall()
+
+        # Лишняя строка показывает, есть ли еще страница в этом направлении
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if cursor is not None and not older:
+            rows.reverse()
+
+        tz = self.user_timezone(user_id)
+        return {
+            # (id, food_text, calories, protein_g, fat_g, carbs_g, created_at UTC, время пользователя)
+            'entries': [row + (self._utc_to_local(row[6], tz),) for row in rows],
+            'has_older': has_more if older else True,
+            'has_newer': (cursor is not None) if older else has_more,
+        }
+
+    @staticmethod
+    def _search_query(text):
+        """Запрос пользователя -> выражение MATCH для food_text (или None).
+
+        Префиксный запрос ("гречк"*) заставляет FTS5 склеить списки всех
+        подходящих слов целиком, а точные слова ищутся с переходом по rowid
+        пользователя. Поэтому вместо префикса перечисляем формы слова.
+        """
+        terms = []
+        for word in re.findall(r'\w+', text.lower()):
+            # Предлоги "с", "и", "в" не ищем
+            if len(word) < 2:
+                continue
+            base = stem(word)
+            forms = dict.fromkeys([word] + [base + ending for ending in ENDINGS])
+            terms.append('(' + ' OR '.join(f'"{form}"' for form in forms) + ')')
+        if not terms:
+            return None
+        return 'food_text : (' + ' AND '.join(terms) + ')'
+
+    def search_entries(self, user_id, text, limit=SEARCH_LIMIT):
+        """Поиск приемов пищи по тексту: новые дни сначала, внутри дня - по релевантности.
+
+        Отбор по пользователю и словам делает индекс FTS5, поэтому время
+        зависит от числа совпадений, а не от размера таблицы. Архив
+        (archive.py) не индексируется - ищем только в горячей базе.
+        """
+        match = self._search_query(text)
+        if match is None:
+            return []
+
+        with self.pool.reader() as conn:
+            rows = conn.execute('''
+            SELECT
+                e.id,
+                e.food_text,
+                e.calories,
+                e.protein_g,
+                e.fat_g,
+                e.carbs_g,
+                e.created_at
+            FROM food_entries_fts
+            JOIN food_entries AS e ON e.id = food_entries_fts.rowid
+            WHERE food_entries_fts MATCH ?
+            ORDER BY e.local_day DESC, food_entries_fts.rank, e.created_at DESC
+            LIMIT ?
+            ''', (f'user_id : "{int(user_id)}" AND {match}', limit)).fetchall()
+
+        tz = self.user_timezone(user_id)
+        # (id, food_text, calories, protein_g, fat_g, carbs_g, created_at UTC, время пользователя)
+        return [row + (self._utc_to_local(row[6], tz),) for row in rows]
 
     def close(self):
-        self.conn.close()
\ No newline at end of file
+        if self.batcher:
+            self.batcher.close()
+        self.pool.close()
+
+
+if __name__ == '__main__':
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+
+    # python database.py rebuild-rollups [user_id]
+    if command == 'rebuild-rollups':
+        db = Database()
+        db.rebuild_rollups(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+        db.close()
+        print("✅ Недельные и месячные итоги пересчитаны")
+    # python database.py rebuild-food-terms [user_id]
+    elif command == 'rebuild-food-terms':
+        db = Database()
+        db.rebuild_food_terms(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+        db.close()
+        print("✅ Частоты продуктов пересчитаны")
+    # python database.py backfill-local-day
+    elif command == 'backfill-local-day':
+        db = Database()
+        db.backfill_local_day()
+        db.close()
+        print("✅ local_day заполнен")
+    else:
+        print("Использование:")
+        print("  python database.py rebuild-rollups [user_id]")
+        print("  python database.py rebuild-food-terms [user_id]")
+        print("  python database.py backfill-local-day")
@@ -0,0 +1,234 @@
+# diary_io.py
+import csv
+import json
+from datetime import datetime, timezone
+
+EXPORT_CHUNK_SIZE = 1000
+IMPORT_BATCH_SIZE = 1000
+
+# Поля в файлах выгрузки (created_at - UTC)
+FIELDS = ['created_at', 'local_day', 'food_text', 'calories', 'protein_g', 'fat_g', 'carbs_g', 'advice']
+
+SELECT_ENTRIES = '''
+SELECT created_at, local_day, food_text, calories, protein_g, fat_g, carbs_g, advice
+FROM {table}
+WHERE user_id = ?
+ORDER BY created_at
+'''
+
+
+def detect_format(filename):
+    """csv или jsonl по расширению файла"""
+    name = (filename or '').lower()
+    if name.endswith('.jsonl') or name.endswith('.json'):
+        return 'jsonl'
+    return 'csv'
+
+
+def _iter_cursor(cursor, chunk_size=EXPORT_CHUNK_SIZE):
+    """Читаем курсор порциями, не загружая результат целиком"""
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield from rows
+
+
+def iter_entries(db, user_id, chunk_size=EXPORT_CHUNK_SIZE):
+    """Все записи пользователя по времени: сначала архивы по годам, затем горячая база"""
+    with db.pool.reader() as conn:
+        for year in sorted(db.archive.years()):
+            with db.archive.attached(conn, year) as schema:
+                cursor = conn.execute(SELECT_ENTRIES.format(table=f'{schema}.food_entries'), (user_id,))
+                yield from _iter_cursor(cursor, chunk_size)
+
+        cursor = conn.execute(SELECT_ENTRIES.format(table='main.food_entries'), (user_id,))
+        yield from _iter_cursor(cursor, chunk_size)
+
+
+def export_diary(db, user_id, path, fmt='csv'):
+    """Выгрузка дневника в файл, возвращаем количество записей"""
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if fmt == 'jsonl':
+            for row in iter_entries(db, user_id):
+                f.write(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) + '\n')
+                count += 1
+        else:
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+            for row in iter_entries(db, user_id):
+                writer.writerow(row)
+                count += 1
+    return count
+
+
+def _read_records(path, fmt):
+    """Построчное чтение файла выгрузки"""
+    with open(path, encoding='utf-8', newline='') as f:
+        if fmt == 'jsonl':
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def _parse_record(db, user_id, record):
+    """Запись из файла -> кортеж для INSERT"""
+    food_text = (record.get('food_text') or '').strip()
+    if not food_text:
+        raise ValueError('пустой food_text')
+
+    created_at = record.get('created_at') or datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    moment = datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+
+    local_day = record.get('local_day')
+    if local_day in (None, ''):
+        local_day = db._to_local_day(moment.astimezone(db.user_timezone(user_id)))
+
+    return (
+        user_id,
+        food_text,
+        int(float(record.get('calories') or 0)),
+        float(record.get('protein_g') or 0),
+        float(record.get('fat_g') or 0),
+        float(record.get('carbs_g') or 0),
+        record.get('advice') or '',
+        created_at,
+        int(local_day)
+    )
+
+
+def _existing_keys(db, conn, user_id, rows):
+    """(created_at, food_text) из rows, которые уже есть в дневнике (горячая база и архивы)"""
+    first = min(row[7] for row in rows)
+    last = max(row[7] for row in rows)
+    query = '''
+    SELECT created_at, food_text FROM {table}
+    WHERE user_id = ? AND created_at BETWEEN ? AND ?
+    '''
+
+    keys = set(conn.execute(query.format(table='main.food_entries'), (user_id, first, last)).fetchall())
+    # ATTACH нельзя внутри транзакции
+    if conn.in_transaction:
+        conn.commit()
+    for year in db.archive.years():
+        if first[:4] <= str(year) <= last[:4]:
+            with db.archive.attached(conn, year) as schema:
+                keys.update(conn.execute(
+                    query.format(table=f'{schema}.food_entries'), (user_id, first, last)
+                ).fetchall())
+    return keys
+
+
+def _day_sums(db, conn, user_id, days):
+    """КБЖУ за дни по всем записям пользователя: local_day -> [ккал, б, ж, у]"""
+    query = '''
+    SELECT local_day, SUM(calories), SUM(protein_g), SUM(fat_g), SUM(carbs_g)
+    FROM {table}
+    WHERE user_id = ? AND local_day BETWEEN ? AND ?
+    GROUP BY local_day
+    '''
+    params = (user_id, min(days), max(days))
+
+    sums = {}
+
+    def add(rows):
+        for day, *values in rows:
+            if day in days:
+                totals = sums.setdefault(day, [0, 0.0, 0.0, 0.0])
+                for i, value in enumerate(values):
+                    totals[i] += value or 0
+
+    add(conn.execute(query.format(table='main.food_entries'), params).fetchall())
+    if conn.in_transaction:
+        conn.commit()
+    years = {day // 10000 for day in days}
+    for year in db.archive.years():
+        if year in years:
+            with db.archive.attached(conn, year) as schema:
+                add(conn.execute(query.format(table=f'{schema}.food_entries'), params).fetchall())
+    return sums
+
+
+def import_diary(db, user_id, path, fmt=None, batch_size=IMPORT_BATCH_SIZE):
+    """Загрузка дневника из CSV/JSONL.
+
+    Записи вставляются через executemany пачками, каждая пачка - своя
+    транзакция. Записи, которые уже есть в дневнике (тот же created_at
+    и food_text), пропускаются, поэтому повторная загрузка своей же
+    выгрузки или повтор после сбоя ничего не удваивают. Дневные итоги
+    всех дней из файла в конце пересчитываются по записям (SUM), а не
+    прибавляются. Возвращаем (загружено, уже было, пропущено).
+    """
+    fmt = fmt or detect_format(path)
+    days = set()
+    imported = 0
+    duplicates = 0
+    skipped = 0
+    batch = []
+
+    def flush():
+        nonlocal imported, duplicates
+        with db.pool.writer() as conn:
+            existing = _existing_keys(db, conn, user_id, batch)
+            rows = []
+            for row in batch:
+                key = (row[7], row[1])
+                if key in existing:
+                    duplicates += 1
+                    continue
+                # Дубли внутри самого файла тоже не вставляем
+                existing.add(key)
+                rows.append(row)
+
+            conn.executemany('''
+            INSERT INTO food_entries
+            (user_id, food_text, calories, protein_g, fat_g, carbs_g, advice, created_at, local_day)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            for row in rows:
+                db._add_food_terms(conn, user_id, row[1], row[7])
+            imported += len(rows)
+        batch.clear()
+
+    for record in _read_records(path, fmt):
+        try:
+            row = _parse_record(db, user_id, record)
+        except (ValueError, TypeError, AttributeError):
+            skipped += 1
+            continue
+
+        batch.append(row)
+        # День пересчитываем, даже если запись уже была: ее могла вставить
+        # прерванная загрузка, которая не дошла до итогов
+        days.add(row[8])
+
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+
+    if days:
+        with db.pool.writer() as conn:
+            sums = _day_sums(db, conn, user_id, days)
+            conn.executemany('''
+            INSERT INTO daily_totals
+            (user_id, date, total_calories, total_protein, total_fat, total_carbs)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, date) DO UPDATE SET
+                total_calories = excluded.total_calories,
+                total_protein = excluded.total_protein,
+                total_fat = excluded.total_fat,
+                total_carbs = excluded.total_carbs
+            ''', (
+                (user_id, f'{day // 10000:04d}-{day // 100 % 100:02d}-{day % 100:02d}', *totals)
+                for day, totals in sums.items()
+            ))
+        # Недельные/месячные итоги и кэш отчетов (частоты продуктов уже учтены)
+        db.rebuild_rollups(user_id)
+
+    return imported, duplicates, skipped
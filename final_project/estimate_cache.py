@@ -0,0 +1,229 @@
+# estimate_cache.py
+import asyncio
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+CACHE_PATH = os.getenv('NUTRITION_CACHE_DB', 'data/estimate_cache.db')
+CACHE_TTL_DAYS = float(os.getenv('NUTRITION_CACHE_TTL_DAYS', '30'))
+CACHE_MAX_ENTRIES = int(os.getenv('NUTRITION_CACHE_MAX_ENTRIES', '100000'))
+CACHE_MEMORY_SIZE = int(os.getenv('NUTRITION_CACHE_MEMORY_SIZE', '2000'))
+
+# Лишние записи сверх CACHE_MAX_ENTRIES удаляем раз в столько добавлений
+EVICT_EVERY = 100
+
+
+class EstimateCache:
+    """Кэш оценок КБЖУ от нейросети.
+
+    Ключ - нормализованный текст еды (openrouter_api.normalize_food).
+    Два уровня: LRU в памяти для самых частых блюд и таблица SQLite,
+    которая переживает перезапуск бота. Записи живут ttl секунд, таблица
+    ограничена max_entries - лишними считаются давно не использованные.
+
+    Из асинхронного кода - методы *_async: запросы к SQLite идут в
+    отдельном потоке кэша и не останавливают цикл событий бота.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL_DAYS * 86400,
+                 max_entries=CACHE_MAX_ENTRIES, memory_size=CACHE_MEMORY_SIZE):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_size = memory_size
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        # Ключи, найденные в памяти: их last_used в таблице обновляется пачкой
+        self._touched = set()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS estimate_cache (
+            key TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        ) WITHOUT ROWID
+        ''')
+        self.conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_estimate_cache_last_used
+        ON estimate_cache (last_used)
+        ''')
+        self.conn.commit()
+
+        # Соединение одно, поэтому и поток для асинхронных вызовов один
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='estimate-cache')
+
+    async def _run(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(method, *args, **kwargs))
+
+    async def get_async(self, key):
+        return await self._run(self.get, key)
+
+    async def put_async(self, key, data):
+        return await self._run(self.put, key, data)
+
+    async def purge_async(self, everything=False):
+        return await self._run(self.purge, everything)
+
+    async def stats_async(self):
+        return await self._run(self.stats)
+
+    def _remember(self, key, data, expires_at):
+        self._memory[key] = (data, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Оценка из кэша (копия словаря) или None"""
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                if item[1] > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    self._touched.add(key)
+                    return dict(item[0])
+                del self._memory[key]
+
+            row = self.conn.execute(
+                'SELECT data, created_at FROM estimate_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or row[1] + self.ttl <= now:
+                self.misses += 1
+                return None
+
+            # Промах памяти - last_used сразу, попадания в память - пачкой в put и _evict
+            self.conn.execute('UPDATE estimate_cache SET last_used = ? WHERE key = ?', (now, key))
+            self.conn.commit()
+            data = json.loads(row[0])
+            self._remember(key, data, row[1] + self.ttl)
+            self.db_hits += 1
+            return dict(data)
+
+    def put(self, key, data):
+        now = time.time()
+        with self._lock:
+            self.conn.execute('''
+            INSERT INTO estimate_cache (key, data, created_at, last_used) VALUES (?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                data = excluded.data,
+                created_at = excluded.created_at,
+                last_used = excluded.last_used
+            ''', (key, json.dumps(data, ensure_ascii=False), now, now))
+            self._flush_touched()
+            self.conn.commit()
+            self._remember(key, dict(data), now + self.ttl)
+
+            self._puts += 1
+            if self._puts % EVICT_EVERY == 0:
+                self._evict()
+
+    def _flush_touched(self):
+        """Записываем last_used ключей, которые находились в памяти, без commit"""
+        if not self._touched:
+            return
+        now = time.time()
+        self.conn.executemany(
+            'UPDATE estimate_cache SET last_used = ? WHERE key = ?',
+            ((now, key) for key in self._touched)
+        )
+        self._touched.clear()
+
+    def _evict(self):
+        """Оставляем max_entries самых свежих по использованию"""
+        # Иначе частые блюда из памяти выглядят давно не использованными
+        self._flush_touched()
+        self.conn.execute('''
+        DELETE FROM estimate_cache WHERE key IN (
+            SELECT key FROM estimate_cache
+            ORDER BY last_used DESC
+            LIMIT -1 OFFSET ?
+        )
+        ''', (self.max_entries,))
+        self.conn.commit()
+
+    def purge(self, everything=False):
+        """Удаляем просроченные записи (или все), возвращаем их количество"""
+        with self._lock:
+            if everything:
+                cursor = self.conn.execute('DELETE FROM estimate_cache')
+                self._memory.clear()
+            else:
+                cursor = self.conn.execute(
+                    'DELETE FROM estimate_cache WHERE created_at <= ?', (time.time() - self.ttl,)
+                )
+                now = time.time()
+                for key in [key for key, (_, expires_at) in self._memory.items() if expires_at <= now]:
+                    del self._memory[key]
+            self.conn.commit()
+            return cursor.rowcount
+
+    def stats(self):
+        with self._lock:
+            size = self.conn.execute('SELECT COUNT(*) FROM estimate_cache').fetchone()[0]
+            hits = self.memory_hits + self.db_hits
+            total = hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+                'hit_rate': hits / total if total else 0.0,
+                'size': size,
+                'memory_size': len(self._memory),
+                'max_entries': self.max_entries,
+            }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._flush_touched()
+            self.conn.commit()
+            self.conn.close()
+
+
+def format_cache_stats(stats):
+    """Текстовый отчет для /nutricache и логов"""
+    return (
+        f"💾 Кэш оценок: {stats['size']} записей (лимит {stats['max_entries']}), "
+        f"в памяти {stats['memory_size']}\n"
+        f"   попадания: память {stats['memory_hits']}, база {stats['db_hits']}, "
+        f"промахи {stats['misses']}, hit rate {stats['hit_rate']:.0%}"
+    )
+
+
+if __name__ == '__main__':
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    cache = EstimateCache()
+
+    # python estimate_cache.py purge [all]
+    if command == 'purge':
+        removed = cache.purge(everything=len(sys.argv) > 2 and sys.argv[2] == 'all')
+        print(f"✅ Удалено записей: {removed}")
+    # python estimate_cache.py stats
+    elif command == 'stats':
+        print(format_cache_stats(cache.stats()))
+    else:
+        print("Использование:")
+        print("  python estimate_cache.py stats")
+        print("  python estimate_cache.py purge [all]")
+    cache.close()
@@ -0,0 +1,325 @@
+# food_catalog.py
+import csv
+import os
+from collections import Counter, deque
+
+from food_text import ADJECTIVE_RE, ADJECTIVE_TAIL_RE, STOP_WORDS, WORD_RE, drop_negated, normalize_text, stem
+
+CATALOG_PATH = os.getenv(
+    'FOOD_CATALOG_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'food_catalog.csv')
+)
+
+# Сколько букв окончания может идти после названия в тексте:
+# "гречк" находит "гречку" и "гречкой", но "рис" не находит "рисунок".
+# Окончание прилагательного не подходит: "морков" не находит "морковный"
+MAX_ENDING = 3
+
+# Нечеткий поиск: слова короче не сравниваем, название - не длиннее FUZZY_MAX_WORDS слов
+FUZZY_MIN_WORD = 3
+FUZZY_MAX_WORDS = 3
+# Названий-кандидатов из триграммного индекса на фрагмент, их сравниваем по словам
+FUZZY_CANDIDATES = 20
+# Каждое слово названия должно найтись во фрагменте хотя бы с таким сходством:
+# "греческий салат" не "йогурт греческий"
+FUZZY_MIN_WORD_SIMILARITY = 0.75
+# Лучший продукт должен опережать следующий хотя бы на столько, иначе ответа нет
+FUZZY_MARGIN = 0.05
+
+
+def _parse_portions(text):
+    """"piece=55;tbsp=20" -> {"piece": 55.0, "tbsp": 20.0}"""
+    portions = {}
+    for item in (text or '').split(';'):
+        unit, _, grams = item.partition('=')
+        if grams:
+            portions[unit.strip()] = float(grams)
+    return portions
+
+
+def edit_distance(a, b):
+    """Расстояние Левенштейна: вставки, удаления и замены букв"""
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def word_similarity(word, pattern):
+    """Сходство слов 0..1 по числу опечаток; окончания не считаются опечатками"""
+    best = 0.0
+    for a, b in ((word, pattern), (stem(word), stem(pattern))):
+        best = max(best, 1 - edit_distance(a, b) / max(len(a), len(b)))
+    return best
+
+
+def trigrams(text):
+    """Триграммы слов с пробелами по краям: "суп" -> {" су", "суп", "уп "}"""
+    result = set()
+    for word in text.split():
+        word = f' {word} '
+        result.update(word[i:i + 3] for i in range(len(word) - 2))
+    return result
+
+
+class FoodCatalog:
+    """Справочник продуктов с КБЖУ на 100 г и поиск по автомату Ахо-Корасик.
+
+    Названия и синонимы всех продуктов собираются в один автомат при
+    загрузке, поэтому поиск в сообщении занимает время, пропорциональное
+    длине сообщения, а не размеру справочника. Из всех найденных
+    названий выбирается самое длинное: "куриная грудка", а не "курица".
+
+    Для опечаток ("курриная грудка") есть триграммный индекс:
+    fuzzy_match выбирает по нему кандидатов, сравнивает их со словами
+    сообщения и возвращает самое похожее название и его сходство.
+    """
+
+    def __init__(self, products=()):
+        # Продукт -> {"calories", "protein", "fat", "carbs"} на 100 г
+        # и "portions" - граммы в штуке/ложке/стакане (quantities.to_grams)
+        self.products = {}
+
+        # Автомат: переходы по буквам, суффиксные ссылки и для каждого
+        # состояния - (продукт, длина названия), которое в нем заканчивается
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]
+        # Ближайшее по суффиксным ссылкам состояние, где заканчивается название
+        self._next_output = [0]
+
+        # Триграммный индекс: триграмма -> номера названий, у названий - продукт,
+        # число триграмм и слова
+        self._trigram_index = {}
+        self._fuzzy_names = []
+        self._fuzzy_sizes = []
+        self._fuzzy_words = []
+
+        for name, data, synonyms in products:
+            self.add(name, data, synonyms)
+        self.build()
+
+    @classmethod
+    def load(cls, path=CATALOG_PATH):
+        """Справочник из CSV: name, calories, protein, fat, carbs, portions, synonyms.
+
+        portions - "piece=55;tbsp=20", synonyms - через ";".
+        """
+        with open(path, encoding='utf-8', newline='') as f:
+            return cls(
+                (
+                    row['name'],
+                    {
+                        **{field: float(row[field]) for field in ('calories', 'protein', 'fat', 'carbs')},
+                        'portions': _parse_portions(row.get('portions')),
+                    },
+                    (row.get('synonyms') or '').split(';')
+                )
+                for row in csv.DictReader(f)
+            )
+
+    def __len__(self):
+        return len(self.products)
+
+    def add(self, name, data, synonyms=()):
+        """Продукт и его синонимы; после добавлений нужен build()"""
+        self.products[name] = data
+        for pattern in {normalize_text(text).strip() for text in (name, *synonyms)}:
+            if pattern:
+                self._add_pattern(pattern, name)
+                self._add_trigrams(pattern, name)
+
+    def _add_trigrams(self, pattern, name):
+        grams = trigrams(pattern)
+        number = len(self._fuzzy_names)
+        self._fuzzy_names.append(name)
+        self._fuzzy_sizes.append(len(grams))
+        self._fuzzy_words.append(pattern.split())
+        for gram in grams:
+            self._trigram_index.setdefault(gram, []).append(number)
+
+    def _add_pattern(self, pattern, name):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+                self._next_output.append(0)
+            state = next_state
+
+        # Одинаковый синоним у двух продуктов - остается первый
+        if self._output[state] is None:
+            self._output[state] = (name, len(pattern))
+
+    def build(self):
+        """Суффиксные ссылки обходом в ширину"""
+        queue = deque()
+        for state in self._goto[0].values():
+            self._fail[state] = 0
+            self._next_output[state] = 0
+            queue.append(state)
+
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[child] = fail
+                self._next_output[child] = fail if self._output[fail] else self._next_output[fail]
+                queue.append(child)
+
+    def find_all(self, text, normalized=False):
+        """Все названия из справочника в тексте: (начало, конец, продукт).
+
+        Название должно начинаться с начала слова и заканчиваться
+        не дальше MAX_ENDING букв от конца слова, и эти буквы - не
+        окончание прилагательного. То, что идет после "без", не ищется.
+        normalized=True - текст уже прошел food_text.normalize_text.
+        """
+        if not normalized:
+            text = normalize_text(text)
+        text = drop_negated(text)
+        goto, fail, output, next_output = self._goto, self._fail, self._output, self._next_output
+
+        found = []
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            match = state if output[state] else next_output[state]
+            while match:
+                name, length = output[match]
+                start = end - length
+                if (start == 0 or not text[start - 1].isalpha()) and self._ending(text, end):
+                    found.append((start, end, name))
+                match = next_output[match]
+        return found
+
+    @staticmethod
+    def _ending(text, end):
+        tail = 0
+        while end + tail < len(text) and text[end + tail].isalpha():
+            tail += 1
+            if tail > MAX_ENDING:
+                return False
+        return not (tail and ADJECTIVE_TAIL_RE.fullmatch(text, end, end + tail))
+
+    def match(self, text, normalized=False):
+        """Самое длинное название продукта в тексте: (продукт, КБЖУ на 100 г) или None"""
+        match = self.match_head(text, normalized)
+        return match and match[:2]
+
+    def match_head(self, text, normalized=False):
+        """Как match, но третьим - главное ли это слово фразы: (продукт, КБЖУ, главное) или None.
+
+        Название из одних прилагательных, за которым идет слово не из
+        справочника, - только определение: "докторская" в "докторская
+        колбаса" - продукт, а в "докторская нарезка" - нет.
+        """
+        if not normalized:
+            text = normalize_text(text)
+        found = self.find_all(text, normalized=True)
+        best = None
+        for start, end, name in found:
+            if best is None or end - start > best[1] - best[0]:
+                best = (start, end, name)
+        if best is None:
+            return None
+        start, end, name = best
+        return name, self.products[name], not self._is_modifier(text, start, end, found)
+
+    @staticmethod
+    def _is_modifier(text, start, end, found):
+        while end < len(text) and text[end].isalpha():
+            end += 1
+        if not all(ADJECTIVE_RE.search(word) for word in WORD_RE.findall(text, start, end)):
+            return False
+        following = WORD_RE.search(text, end)
+        if following is None or following.group() in STOP_WORDS or len(following.group()) < FUZZY_MIN_WORD:
+            return False
+        return not any(found_start <= following.start() < found_end for found_start, found_end, _ in found)
+
+    def fuzzy_match(self, text, min_similarity, normalized=False):
+        """Самый похожий продукт: (продукт, КБЖУ на 100 г, сходство) или None.
+
+        Сравниваются фрагменты текста до FUZZY_MAX_WORDS слов подряд
+        с названиями и синонимами. Кандидаты - FUZZY_CANDIDATES названий
+        с наибольшим коэффициентом Дайса по триграммам. Сходство с
+        кандидатом - по словам (word_similarity): каждое слово названия
+        сопоставляется своему слову фрагмента не хуже
+        FUZZY_MIN_WORD_SIMILARITY, лишние слова фрагмента снижают
+        сходство: 2 * сумма сходств / (слов в названии + во фрагменте).
+        Если второй по сходству продукт отстает меньше чем на
+        FUZZY_MARGIN, ответ неоднозначен - None.
+        """
+        if not normalized:
+            text = normalize_text(text)
+        words = [word for word in WORD_RE.findall(drop_negated(text)) if len(word) >= FUZZY_MIN_WORD]
+
+        # Продукт -> лучшее сходство
+        scores = {}
+        for start in range(len(words)):
+            for end in range(start + 1, min(start + FUZZY_MAX_WORDS, len(words)) + 1):
+                fragment = words[start:end]
+                grams = trigrams(' '.join(fragment))
+                shared = Counter()
+                for gram in grams:
+                    postings = self._trigram_index.get(gram)
+                    if postings:
+                        shared.update(postings)
+
+                candidates = sorted(
+                    shared,
+                    key=lambda number: shared[number] / (len(grams) + self._fuzzy_sizes[number]),
+                    reverse=True
+                )[:FUZZY_CANDIDATES]
+                for number in candidates:
+                    score = self._words_similarity(fragment, self._fuzzy_words[number])
+                    name = self._fuzzy_names[number]
+                    if score is not None and score > scores.get(name, 0.0):
+                        scores[name] = score
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        if not ranked or ranked[0][1] < min_similarity:
+            return None
+        if len(ranked) > 1 and ranked[0][1] - ranked[1][1] < FUZZY_MARGIN:
+            return None
+        name, score = ranked[0]
+        return name, self.products[name], score
+
+    @staticmethod
+    def _words_similarity(fragment, pattern_words):
+        """Сходство фрагмента с названием по словам или None, если слово названия не нашлось"""
+        free = list(range(len(fragment)))
+        total = 0.0
+        for pattern_word in pattern_words:
+            similarity, position = max(
+                ((word_similarity(fragment[i], pattern_word), i) for i in free),
+                default=(0.0, None)
+            )
+            if similarity < FUZZY_MIN_WORD_SIMILARITY:
+                return None
+            free.remove(position)
+            total += similarity
+        return 2 * total / (len(pattern_words) + len(fragment))
+
+
+if __name__ == '__main__':
+    import sys
+
+    # python food_catalog.py "куриная грудка 200г"
+    catalog = FoodCatalog.load()
+    print(f"📚 Продуктов в справочнике: {len(catalog)}")
+    for text in sys.argv[1:]:
+        print(f"   {text!r} -> {catalog.match(text) or catalog.fuzzy_match(text, 0.8)}")
@@ -0,0 +1,46 @@
+# food_terms.py
+from food_catalog import FoodCatalog
+from food_text import STOP_WORDS, WORD_RE, drop_negated, normalize_text, stem
+
+MIN_TERM_LENGTH = 3
+
+# Справочник загружается при первом подсчете
+_catalog = None
+
+
+def _food_catalog():
+    global _catalog
+    if _catalog is None:
+        _catalog = FoodCatalog.load()
+    return _catalog
+
+
+def extract_food_terms(food_text):
+    """Продукты из текста приема пищи: [(ключ, слово для показа)].
+
+    Продукт из справочника (food_catalog) учитывается под своим названием
+    в любой форме и по синонимам, остальные слова - по основе без
+    окончания (food_text.stem), показывается первая встреченная форма:
+    "молоко" и "молоком" - один продукт. Числа, единицы, служебные слова
+    и то, что идет после "без", отбрасываются. Каждый продукт учитывается
+    один раз - счетчик в user_food_terms показывает, в скольких приемах
+    пищи он встречался.
+    """
+    text = drop_negated(normalize_text(food_text))
+    terms = {}
+
+    # Самые длинные непересекающиеся названия: "куриная грудка", а не "курица"
+    covered = []
+    for start, end, name in sorted(_food_catalog().find_all(text, normalized=True), key=lambda found: (found[0], found[0] - found[1])):
+        if covered and start < covered[-1][1]:
+            continue
+        covered.append((start, end))
+        terms.setdefault(name, name)
+
+    for match in WORD_RE.finditer(text):
+        if any(start <= match.start() < end for start, end in covered):
+            continue
+        word = match.group()
+        if len(word) >= MIN_TERM_LENGTH and word not in STOP_WORDS:
+            terms.setdefault(stem(word), word)
+    return list(terms.items())
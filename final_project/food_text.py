@@ -0,0 +1,67 @@
+# food_text.py
+import re
+
+# Латинские буквы, похожие на русские: "гречкa" с латинской "a"
+HOMOGLYPHS = str.maketrans('aceopxykmthb', 'асеорхукмтнв')
+MIXED_WORD_RE = re.compile(r'[a-zа-я]*[а-я][a-zа-я]*')
+LATIN_RE = re.compile(r'[a-z]')
+
+# Слово из букв (дефис внутри слова сохраняется: "из-под", "чиз-кейк")
+WORD_RE = re.compile(r'[a-zа-я]+(?:-[a-zа-я]+)*')
+# Слова и числа - для ключа кэша оценок
+TOKEN_RE = re.compile(r'[a-zа-я0-9]+')
+
+# Служебные слова, которые не меняют оценку блюда ("без" - меняет)
+FILLER_WORDS = {'с', 'со', 'на', 'в', 'во', 'из', 'по', 'для', 'немного', 'порция'}
+
+# Слова, которые не являются продуктами
+STOP_WORDS = FILLER_WORDS | {
+    'и', 'без', 'изо', 'под', 'или', 'это',
+    'много', 'половина', 'пол', 'порции', 'кусок', 'куска', 'кусочек',
+    'стакан', 'стакана', 'чашка', 'чашки', 'ложка', 'ложки', 'ложку', 'тарелка', 'тарелки',
+    'штука', 'штуки', 'штук', 'грамм', 'грамма', 'граммов', 'кг', 'мл', 'литр', 'литра',
+}
+
+# Отрицание: "кофе без сахара", "чай без добавления сахара и молока" -
+# всё после "без" до разделителя, числа или "с" не съедено
+NEGATION_RE = re.compile(r'\bбез\b.*?(?=[,;+\n\d]|\bсо?\b|$)')
+
+# Окончания прилагательных: "морковный торт", "кукурузные хлопья"
+ADJECTIVE_RE = re.compile(r'(?:ый|ий|ой|ая|яя|ое|ее|ые|ие|ую|юю|ых|их|ым|им|ого|его|ому|ему|ыми|ими)$')
+# Хвост после основы существительного, который делает из нее прилагательное: морков|ный
+ADJECTIVE_TAIL_RE = re.compile(r'н(?:ый|ий|ой|ая|яя|ое|ее|ые|ие|ую|юю|ых|их|ым|им)')
+
+# Падежные окончания, длинные раньше коротких: "гречку" и "гречка" -> "гречк"
+ENDINGS = (
+    'ами', 'ями', 'ой', 'ей', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ью',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й', ''
+)
+# Основа не короче MIN_STEM букв: "сок" остается "сок"
+MIN_STEM = 3
+
+
+def _fix_homoglyphs(match):
+    word = match.group()
+    return word.translate(HOMOGLYPHS) if LATIN_RE.search(word) else word
+
+
+def normalize_text(text):
+    """Нижний регистр, ё -> е, латиница в русских словах -> кириллица"""
+    text = (text or '').lower().replace('ё', 'е')
+    # Латиница внутри русского слова - опечатка раскладки
+    if not text.isascii() and LATIN_RE.search(text):
+        text = MIXED_WORD_RE.sub(_fix_homoglyphs, text)
+    return text
+
+
+def drop_negated(text):
+    """Текст без того, что идет после "без"; позиции остальных слов не меняются"""
+    return NEGATION_RE.sub(lambda match: ' ' * len(match.group()), text)
+
+
+def stem(word):
+    """Слово без падежного окончания: "молоком" -> "молок" """
+    for ending in ENDINGS:
+        if ending and word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
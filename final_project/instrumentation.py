@@ -0,0 +1,200 @@
+# instrumentation.py
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+INSTRUMENT = os.getenv('DB_INSTRUMENT', '0') == '1'
+SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '50'))
+
+# Границы корзин гистограммы задержек, мс
+BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, float('inf'))
+
+
+def _normalize(sql):
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+class _Metric:
+    __slots__ = ('count', 'total_ms', 'max_ms', 'rows', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.buckets = [0] * len(BUCKETS_MS)
+
+    def add(self, elapsed_ms):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        for i, bound in enumerate(BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[i] += 1
+                break
+
+    def percentile(self, fraction):
+        """Оценка перцентиля по гистограмме (верхняя граница корзины)"""
+        target = self.count * fraction
+        seen = 0
+        for bound, hits in zip(BUCKETS_MS, self.buckets):
+            seen += hits
+            if seen >= target:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'avg_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'max_ms': round(self.max_ms, 3),
+            'rows': self.rows,
+            'histogram': dict(zip(BUCKETS_MS, self.buckets)),
+        }
+
+
+class QueryStats:
+    """Статистика запросов: задержки, строки, ожидание блокировок"""
+
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS):
+        self.slow_query_ms = slow_query_ms
+        self._statements = {}
+        self._waits = {}
+        self._lock = threading.Lock()
+
+    def record_query(self, sql, elapsed_ms):
+        key = _normalize(sql)
+        with self._lock:
+            metric = self._statements.get(key)
+            if metric is None:
+                metric = self._statements[key] = _Metric()
+            metric.add(elapsed_ms)
+        return key
+
+    def record_rows(self, key, rows):
+        with self._lock:
+            self._statements[key].rows += rows
+
+    def record_wait(self, name, elapsed_ms):
+        """Ожидание писателя или свободного соединения из пула"""
+        with self._lock:
+            metric = self._waits.get(name)
+            if metric is None:
+                metric = self._waits[name] = _Metric()
+            metric.add(elapsed_ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'statements': {sql: m.snapshot() for sql, m in self._statements.items()},
+                'lock_waits': {name: m.snapshot() for name, m in self._waits.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._waits.clear()
+
+    def report(self, top=10):
+        """Текстовый отчет: самые затратные запросы по суммарному времени"""
+        data = self.snapshot()
+        lines = []
+
+        for name, m in sorted(data['lock_waits'].items()):
+            lines.append(
+                f"⏳ {name}: {m['count']} раз, avg {m['avg_ms']:.2f} мс, "
+                f"p95 {m['p95_ms']:.2f} мс, max {m['max_ms']:.2f} мс"
+            )
+
+        statements = sorted(data['statements'].items(), key=lambda item: -item[1]['total_ms'])
+        for sql, m in statements[:top]:
+            lines.append(
+                f"\n{sql[:120]}\n"
+                f"  {m['count']} раз | всего {m['total_ms']:.1f} мс | avg {m['avg_ms']:.2f} | "
+                f"p95 {m['p95_ms']:.2f} | max {m['max_ms']:.2f} | строк {m['rows']}"
+            )
+
+        return '\n'.join(lines) if lines else 'Нет данных'
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Курсор, который замеряет каждый запрос и считает прочитанные строки"""
+
+    _stats_key = None
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._stats_key = self.connection.stats.record_query(sql, elapsed_ms)
+        if elapsed_ms >= self.connection.stats.slow_query_ms:
+            self._log_slow(sql, parameters, elapsed_ms)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._stats_key = self.connection.stats.record_query(sql, elapsed_ms)
+        if elapsed_ms >= self.connection.stats.slow_query_ms:
+            logger.warning(f"Медленный executemany {elapsed_ms:.1f} мс: {_normalize(sql)[:200]}")
+        return self
+
+    def _log_slow(self, sql, parameters, elapsed_ms):
+        plan = ''
+        try:
+            # Обычный курсор, чтобы EXPLAIN не попал в статистику
+            rows = sqlite3.Cursor(self.connection).execute(
+                'EXPLAIN QUERY PLAN ' + sql, parameters
+            ).fetchall()
+            plan = '; '.join(row[-1] for row in rows)
+        except sqlite3.Error:
+            pass
+        logger.warning(f"Медленный запрос {elapsed_ms:.1f} мс: {_normalize(sql)[:200]} | план: {plan}")
+
+    def _count(self, rows):
+        if self._stats_key is not None and rows:
+            self.connection.stats.record_rows(self._stats_key, rows)
+
+    def fetchone(self):
+        row = super().fetchone()
+        self._count(1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._count(len(rows))
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Соединение, у которого все курсоры - InstrumentedCursor.
+
+    Подключается только если инструментирование включено, иначе
+    используется обычный sqlite3.Connection без накладных расходов.
+    """
+
+    stats = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute в C создает курсор в обход cursor(), поэтому явно
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -0,0 +1,205 @@
+# maintenance.py
+import os
+import struct
+import time
+
+MAINTENANCE_INTERVAL_MINUTES = float(os.getenv('FOOD_DIARY_MAINTENANCE_MINUTES', '10'))
+
+# Затишье: столько секунд без записей, чтобы делать TRUNCATE checkpoint
+QUIET_SECONDS = 30
+# Если WAL вырос больше, обрезаем его и без затишья
+WAL_FORCE_CHECKPOINT_BYTES = 256 * 1024 * 1024
+
+# incremental_vacuum по VACUUM_STEP_PAGES страниц за раз, писатель занят недолго
+VACUUM_STEP_PAGES = 2_000
+# Освобождаем место, когда свободных страниц больше этой доли файла
+VACUUM_FREELIST_RATIO = 0.1
+
+
+# Заголовок wal-index в файле -shm (формат SQLite, порядок байт платформы):
+# mxFrame - последний кадр WAL, nBackfill - сколько кадров уже перенесено в базу
+WAL_INDEX_HEADER = struct.Struct('=I')
+WAL_INDEX_MAX_FRAME = 16
+WAL_INDEX_BACKFILL = 96
+
+
+def _wal_lag(path):
+    """Кадры WAL, еще не перенесенные в базу, - из -shm, без checkpoint и блокировок"""
+    try:
+        with open(path + '-shm', 'rb') as f:
+            header = f.read(WAL_INDEX_BACKFILL + WAL_INDEX_HEADER.size)
+    except OSError:
+        return 0
+    if len(header) < WAL_INDEX_BACKFILL + WAL_INDEX_HEADER.size:
+        return 0
+    max_frame, = WAL_INDEX_HEADER.unpack_from(header, WAL_INDEX_MAX_FRAME)
+    backfilled, = WAL_INDEX_HEADER.unpack_from(header, WAL_INDEX_BACKFILL)
+    return max(max_frame - backfilled, 0)
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class DiaryMaintenance:
+    """Периодическое обслуживание файлов SQLite внутри процесса бота.
+
+    - incremental_vacuum небольшими порциями возвращает свободные страницы ОС;
+    - в затишье wal_checkpoint(TRUNCATE) переносит WAL в базу и обрезает его,
+      при постоянной записи - только если WAL стал слишком большим;
+    - PRAGMA optimize обновляет статистику планировщика по мере надобности.
+    Для шардов обслуживается каждый файл. Базу, созданную до
+    auto_vacuum=INCREMENTAL, один раз переводит convert() - вручную.
+    """
+
+    def __init__(self, db, quiet_seconds=QUIET_SECONDS, wal_limit=WAL_FORCE_CHECKPOINT_BYTES,
+                 vacuum_pages=VACUUM_STEP_PAGES, freelist_ratio=VACUUM_FREELIST_RATIO):
+        self.db = db
+        self.quiet_seconds = quiet_seconds
+        self.wal_limit = wal_limit
+        self.vacuum_pages = vacuum_pages
+        self.freelist_ratio = freelist_ratio
+
+    def _databases(self):
+        return getattr(self.db, 'shards', [self.db])
+
+    def status(self, database):
+        """Размер файлов, свободные страницы и отставание checkpoint.
+
+        Только читает: счетчики страниц - через соединение читателя,
+        отставание - из заголовка -shm, писатель не занимается.
+        """
+        path = database.pool.path
+        with database.pool.reader() as conn:
+            page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+            page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+            freelist = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            # 2 - INCREMENTAL; иначе incremental_vacuum ничего не освобождает
+            auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+
+        return {
+            'path': path,
+            'file_size': _file_size(path),
+            'wal_size': _file_size(path + '-wal'),
+            'page_size': page_size,
+            'page_count': page_count,
+            'freelist_pages': freelist,
+            'incremental_vacuum': auto_vacuum == 2,
+            # Кадры WAL, которые еще не перенесены в основной файл
+            'checkpoint_lag': _wal_lag(path),
+        }
+
+    def statuses(self):
+        """Состояние всех файлов базы без обслуживания и checkpoint"""
+        return [
+            self.status(database) for database in self._databases()
+            if database.pool.path != ':memory:'
+        ]
+
+    def convert(self):
+        """Разовый перевод старых файлов в auto_vacuum=INCREMENTAL полным VACUUM.
+
+        Пока идет VACUUM, база заблокирована, и нужно свободное место
+        размером с файл, поэтому запускается отдельно, а не при старте бота.
+        Возвращаем пути переведенных файлов.
+        """
+        converted = []
+        for database in self._databases():
+            if database.pool.path == ':memory:':
+                continue
+            with database.pool.writer(touch=False) as conn:
+                if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                    continue
+                # VACUUM нельзя выполнять внутри транзакции
+                if conn.in_transaction:
+                    conn.commit()
+                conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                conn.execute('VACUUM')
+            converted.append(database.pool.path)
+        return converted
+
+    def _vacuum(self, database, freelist, page_count):
+        if not page_count or freelist / page_count < self.freelist_ratio:
+            return 0
+
+        freed = 0
+        while freed < freelist:
+            # Каждая порция - отдельная короткая транзакция писателя
+            with database.pool.writer(touch=False) as conn:
+                before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                if not before:
+                    break
+                conn.execute(f'PRAGMA incremental_vacuum({self.vacuum_pages})').fetchall()
+                after = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            freed += before - after
+            if after == before:
+                break
+        return freed
+
+    def _checkpoint(self, database, wal_size):
+        quiet = time.monotonic() - database.pool.last_write >= self.quiet_seconds
+        if not quiet and wal_size < self.wal_limit:
+            return None
+
+        with database.pool.writer(touch=False) as conn:
+            busy, _, _ = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        return 'busy' if busy else 'truncated'
+
+    def run(self):
+        """Один проход обслуживания, возвращаем состояние файлов после него"""
+        report = []
+        for database in self._databases():
+            if database.pool.path == ':memory:':
+                continue
+
+            status = self.status(database)
+            freed = self._vacuum(database, status['freelist_pages'], status['page_count'])
+            with database.pool.writer(touch=False) as conn:
+                conn.execute('PRAGMA optimize')
+            # Последним: переносим в базу и кадры, записанные vacuum и optimize.
+            # Свои записи обслуживание пишет с touch=False - затишье они не прерывают
+            checkpoint = self._checkpoint(database, _file_size(database.pool.path + '-wal'))
+
+            if freed or checkpoint:
+                status = self.status(database)
+            status['freed_pages'] = freed
+            status['checkpoint'] = checkpoint
+            report.append(status)
+        return report
+
+
+def format_maintenance_report(report):
+    """Текстовый отчет для логов и /dbstats"""
+    lines = []
+    for status in report:
+        lines.append(
+            f"🗄 {os.path.basename(status['path'])}: "
+            f"{status['file_size'] / 1024 / 1024:.1f} МБ, "
+            f"WAL {status['wal_size'] / 1024 / 1024:.1f} МБ, "
+            f"свободно {status['freelist_pages']} из {status['page_count']} стр., "
+            f"отставание checkpoint {status['checkpoint_lag']} кадров"
+        )
+        if not status.get('incremental_vacuum', True):
+            lines.append("   освобождение места по частям не включено: python maintenance.py convert")
+        if status.get('freed_pages'):
+            lines.append(f"   освобождено страниц: {status['freed_pages']}")
+        if status.get('checkpoint'):
+            lines.append(f"   checkpoint(TRUNCATE): {status['checkpoint']}")
+    return '\n'.join(lines) if lines else 'Нет файлов базы'
+
+
+if __name__ == '__main__':
+    import sys
+    from sharding import open_database
+
+    # python maintenance.py [convert]
+    db = open_database()
+    if len(sys.argv) > 1 and sys.argv[1] == 'convert':
+        converted = DiaryMaintenance(db).convert()
+        print(f"✅ Переведено в auto_vacuum=INCREMENTAL: {', '.join(converted) or 'нечего'}")
+    else:
+        print(format_maintenance_report(DiaryMaintenance(db).run()))
+    db.close()
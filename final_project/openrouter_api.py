@@ -1,4 +1,6 @@
 # openrouter_api.py
+import asyncio
+import httpx
 import requests
 import json
 import time
@@ -6,21 +8,135 @@ import re
 import os
 from dotenv import load_dotenv
 
+from food_catalog import FoodCatalog
+from food_text import FILLER_WORDS, TOKEN_RE, normalize_text
+from quantities import food_weight, parse_quantities
+
+
 load_dotenv()
 
+OPENROUTER_TIMEOUT = float(os.getenv('OPENROUTER_TIMEOUT', '30'))
+# Одновременных запросов к API и соединений в пуле
+OPENROUTER_MAX_CONCURRENCY = int(os.getenv('OPENROUTER_MAX_CONCURRENCY', '8'))
+OPENROUTER_MAX_CONNECTIONS = int(os.getenv('OPENROUTER_MAX_CONNECTIONS', '10'))
+OPENROUTER_KEEPALIVE_SECONDS = 60
+
+# Минимальное сходство (0..1) для продукта с опечаткой из справочника вместо запроса к API
+FUZZY_MIN_SIMILARITY = float(os.getenv('FOOD_FUZZY_MIN_SIMILARITY', '0.8'))
+# Уверенность, если название из справочника - только определение ("докторская нарезка")
+MODIFIER_CONFIDENCE = 0.5
+
+# Разделители блюд в одном сообщении. Запятая между цифрами - десятичная: "0,5 кг"
+ITEM_SEPARATOR_RE = re.compile(r'(?<!\d),(?!\d)|[;+]|\bи\b')
+# Разделители продуктов в составном приеме пищи: "курица 150г + рис 100г", "кофе с молоком"
+MEAL_SEPARATOR_RE = re.compile(r'(?<!\d),(?!\d)|[;+\n]|\b(?:и|с|со)\b', re.IGNORECASE)
+LETTER_RE = re.compile(r'[a-zа-яё]', re.IGNORECASE)
+
+NUTRITION_FIELDS = ('calories', 'protein_g', 'fat_g', 'carbs_g')
+
+
+def normalize_food(food_text):
+    """Каноническое название блюда и вес в граммах (или None).
+
+    "Гречка 200г" и "гречка, 150 гр" -> ("гречка", 200.0) и ("гречка", 150.0):
+    регистр, ё, латиница в русских словах, пунктуация и служебные слова
+    убираются, блюда в списке сортируются ("творог и банан" == "банан, творог").
+    Вес (граммы или миллилитры) отделяется, только если количество в тексте
+    одно - иначе не понятно, к чему оно относится.
+    """
+    text = normalize_text(food_text)
+
+    weight = None
+    quantities = parse_quantities(text, normalized=True)
+    # Штуки и ложки без справочника в граммы не перевести - они остаются в названии
+    if len(quantities) == 1 and quantities[0].unit in ('g', 'ml'):
+        weight = quantities[0].value
+        text = text[:quantities[0].start] + ' ' + text[quantities[0].end:]
+
+    items = []
+    for item in ITEM_SEPARATOR_RE.split(text):
+        words = [word for word in TOKEN_RE.findall(item) if word not in FILLER_WORDS]
+        if words:
+            items.append(' '.join(words))
+
+    return ' + '.join(sorted(items)), (weight or None)
+
+
+def split_meal(food_text):
+    """Продукты составного приема пищи с их весом.
+
+    "Курица 150г + рис 100г" -> ["Курица 150г", "рис 100г"],
+    "яблоко, кофе с молоком" -> ["яблоко", "кофе", "молоком"],
+    "гречка 0,5 кг" - один продукт: запятая между цифрами не разделяет.
+    Кусок, где кроме количества ничего нет, относится к предыдущему
+    продукту: "гречка, 150 гр" -> ["гречка 150 гр"] (в начале - к следующему).
+    Пустые куски (лишние запятые) отбрасываются.
+    """
+    items = []
+    quantity = ''
+    for item in MEAL_SEPARATOR_RE.split(food_text or ''):
+        item = item.strip(' .!?')
+        if not item:
+            continue
+        if _has_food(item):
+            items.append(f'{quantity} {item}'.strip())
+            quantity = ''
+        elif items:
+            items[-1] = f'{items[-1]} {item}'
+        else:
+            quantity = f'{quantity} {item}'.strip()
+    return items
+
+
+def _has_food(item):
+    """Есть ли в куске что-то кроме количеств ("150 гр", "2 шт" - нет)"""
+    text = normalize_text(item)
+    for quantity in reversed(parse_quantities(text, normalized=True)):
+        text = text[:quantity.start] + ' ' + text[quantity.end:]
+    return LETTER_RE.search(text) is not None
+
+
+def _scale_nutrition(data, factor, rounded=True):
+    """КБЖУ, умноженные на factor (порция <-> 100 г)"""
+    scaled = dict(data)
+    for field in NUTRITION_FIELDS:
+        scaled[field] = float(data[field]) * factor
+    if rounded:
+        scaled['calories'] = int(round(scaled['calories']))
+        for field in ('protein_g', 'fat_g', 'carbs_g'):
+            scaled[field] = round(scaled[field], 1)
+    return scaled
+
+
+# HTTP/2 в httpx требует пакет h2 (pip install httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 class OpenRouterNutrition:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, cache=None, catalog=None, fuzzy_similarity=FUZZY_MIN_SIMILARITY):
         self.api_key = api_key or os.getenv('OPENROUTER_API_KEY')
         self.base_url = "https://openrouter.ai/api/v1/chat/completions"
 
-        # Локальная база для запасного варианта
-        self.local_db = {
-            "овсянка": {"calories": 350, "protein": 12, "fat": 6, "carbs": 60},
-            "творог": {"calories": 120, "protein": 18, "fat": 5, "carbs": 4},
-            "куриная грудка": {"calories": 165, "protein": 31, "fat": 3.6, "carbs": 0},
-            "гречка": {"calories": 130, "protein": 4.5, "fat": 1.3, "carbs": 27},
-            "яйцо": {"calories": 70, "protein": 6, "fat": 5, "carbs": 0.6},
-        }
+        # EstimateCache для ответов нейросети (None - без кэша)
+        self.cache = cache
+
+        # Keep-alive соединение для синхронных вызовов
+        self._session = requests.Session()
+        # Асинхронный клиент создается при первом запросе внутри цикла событий
+        self._client = None
+        self._semaphore = None
+
+        # Запросы к API в полете: ключ кэша -> (задача, вес порции)
+        self._in_flight = {}
+        self.api_calls = 0
+        self.coalesced_calls = 0
+
+        # Справочник продуктов (food_catalog.csv), автомат строится один раз
+        self.catalog = catalog if catalog is not None else FoodCatalog.load()
+        self.fuzzy_similarity = fuzzy_similarity
 
         if self.api_key:
             print("✅ OpenRouter API инициализирован (модель: GPT-3.5-Turbo)")
@@ -29,6 +145,9 @@ class OpenRouterNutrition:
 
     def estimate_nutrition(self, food_text):
         """Получаем КБЖУ через OpenRouter или локальную базу"""
+        items = split_meal(food_text)
+        if len(items) > 1:
+            return self.estimate_meal(items)
 
         # Сначала пробуем локальную базу
         result = self.local_db_estimate(food_text)
@@ -37,56 +156,220 @@ class OpenRouterNutrition:
 
         # Если есть API ключ и продукт не найден локально
         if self.api_key:
-            return self.openrouter_estimate(food_text)
+            cached = self.cached_estimate(food_text)
+            if cached:
+                return cached
+            result = self.openrouter_estimate(food_text)
+            self.store_estimate(food_text, result)
+            return result
         else:
             # Нет ключа - используем запасной вариант
             return self.fallback_estimate(food_text)
 
+    def _resolve_items(self, items):
+        """Оценки продуктов из локальной базы и кэша.
+
+        Возвращаем (оценки, номера продуктов без оценки) - только
+        они уходят в нейросеть. Без ключа API промахов не бывает:
+        для них сразу берется запасная оценка.
+        """
+        results = [None] * len(items)
+        misses = []
+        for i, item in enumerate(items):
+            result = self.local_db_estimate(item)
+            if "source" not in result:
+                result = self.cached_estimate(item) if self.api_key else self.fallback_estimate(item)
+            if result:
+                results[i] = result
+            else:
+                misses.append(i)
+        return results, misses
+
+    async def _resolve_items_async(self, items):
+        """То же, что _resolve_items, но кэш читается в потоке кэша"""
+        results = [None] * len(items)
+        misses = []
+        for i, item in enumerate(items):
+            result = self.local_db_estimate(item)
+            if "source" not in result:
+                result = await self.cached_estimate_async(item) if self.api_key else self.fallback_estimate(item)
+            if result:
+                results[i] = result
+            else:
+                misses.append(i)
+        return results, misses
+
+    def estimate_meal(self, items):
+        """КБЖУ составного приема пищи: промахи - одним запросом к API"""
+        results, misses = self._resolve_items(items)
+        if len(misses) == 1:
+            i = misses[0]
+            results[i] = self.openrouter_estimate(items[i])
+            self.store_estimate(items[i], results[i])
+        elif misses:
+            texts = [items[i] for i in misses]
+            for i, result in zip(misses, self.openrouter_batch_estimate(texts)):
+                results[i] = result
+                self.store_estimate(items[i], result)
+        return self._combine_items(items, results)
+
+    def _combine_items(self, items, results):
+        """Сумма КБЖУ по продуктам и разбивка для ответа пользователю"""
+        meal = {field: 0.0 for field in NUTRITION_FIELDS}
+        meal["items"] = []
+        for item, result in zip(items, results):
+            try:
+                values = {field: float(result[field]) for field in NUTRITION_FIELDS}
+            except (KeyError, TypeError, ValueError):
+                # Нейросеть вернула не числа - берем запасную оценку продукта
+                result = self.fallback_estimate(item)
+                values = {field: float(result[field]) for field in NUTRITION_FIELDS}
+
+            for field, value in values.items():
+                meal[field] += value
+            meal["items"].append({
+                "food": item,
+                "calories": int(round(values["calories"])),
+                "protein_g": round(values["protein_g"], 1),
+                "fat_g": round(values["fat_g"], 1),
+                "carbs_g": round(values["carbs_g"], 1),
+                "source": result.get("source"),
+            })
+
+        meal["calories"] = int(round(meal["calories"]))
+        for field in ('protein_g', 'fat_g', 'carbs_g'):
+            meal[field] = round(meal[field], 1)
+
+        # Совет нейросети о блюде полезнее шаблонного из локальной базы
+        advices = [result.get("advice") for result in results if result.get("source") in ("openrouter_gpt", "cache")]
+        meal["advice"] = next((advice for advice in advices if advice), None) or results[0].get("advice", "")
+        meal["source"] = "meal"
+        return meal
+
+    @staticmethod
+    def _cache_key(food_text):
+        """Ключ кэша и вес порции: с весом храним КБЖУ на 100 г"""
+        name, weight = normalize_food(food_text)
+        if not name:
+            return None, None
+        return (f"{name}|100г" if weight else name), weight
+
+    def cached_estimate(self, food_text):
+        """Сохраненная оценка нейросети, пересчитанная на вес порции"""
+        if self.cache is None:
+            return None
+        key, weight = self._cache_key(food_text)
+        return self._from_cache(self.cache.get(key) if key else None, weight)
+
+    async def cached_estimate_async(self, food_text):
+        """То же, что cached_estimate, запрос к кэшу - в потоке кэша"""
+        if self.cache is None:
+            return None
+        key, weight = self._cache_key(food_text)
+        return self._from_cache(await self.cache.get_async(key) if key else None, weight)
+
+    @staticmethod
+    def _from_cache(result, weight):
+        if not result:
+            return None
+        result = _scale_nutrition(result, weight / 100 if weight else 1)
+        result["source"] = "cache"
+        return result
+
+    def store_estimate(self, food_text, result):
+        """Кэшируем только ответы нейросети, запасную оценку - нет"""
+        entry = self._cache_entry(food_text, result)
+        if entry:
+            self.cache.put(*entry)
+
+    async def store_estimate_async(self, food_text, result):
+        """То же, что store_estimate, запись в кэш - в потоке кэша"""
+        entry = self._cache_entry(food_text, result)
+        if entry:
+            await self.cache.put_async(*entry)
+
+    def _cache_entry(self, food_text, result):
+        """(ключ, КБЖУ на 100 г или на порцию) для кэша или None"""
+        if self.cache is None or result.get("source") != "openrouter_gpt":
+            return None
+        key, weight = self._cache_key(food_text)
+        if not key:
+            return None
+        try:
+            # Без округления, чтобы пересчет на другую порцию не копил ошибку
+            return key, _scale_nutrition(result, 100 / weight if weight else 1, rounded=False)
+        except (KeyError, TypeError, ValueError):
+            # Нейросеть вернула не числа - такой ответ не кэшируем
+            return None
+
     def local_db_estimate(self, food_text):
-        """Поиск в локальной базе"""
-        food_lower = food_text.lower()
+        """Поиск в справочнике продуктов: точное название, затем похожее.
+
+        confidence - сходство с названием из справочника (1.0 - точное,
+        MODIFIER_CONFIDENCE - название только определяет другое слово).
+        С ключом API оценка ниже fuzzy_similarity не возвращается - только
+        {"confidence": ...}, чтобы продукт ушел в нейросеть.
+        Текст нормализуется один раз для всех поисков.
+        """
+        text = normalize_text(food_text)
+        match = self.catalog.match_head(text, normalized=True)
+        if match:
+            food_name, data, head = match
+            similarity = 1.0 if head else MODIFIER_CONFIDENCE
+            if similarity < self.fuzzy_similarity and self.api_key:
+                return {"confidence": similarity}
+            advice = "Данные из локальной базы продуктов"
+        else:
+            match = self.catalog.fuzzy_match(text, self.fuzzy_similarity, normalized=True)
+            if not match:
+                return {"confidence": 0.0}
+            food_name, data, similarity = match
+            advice = f"Данные из локальной базы продуктов: похоже на «{food_name}»"
+
+        # Вес с учетом штук, ложек и стаканов этого продукта
+        weight = self.extract_weight(text, data.get("portions"), normalized=True)
+        factor = weight / 100
+
+        return {
+            "calories": int(data["calories"] * factor),
+            "protein_g": round(data["protein"] * factor, 1),
+            "fat_g": round(data["fat"] * factor, 1),
+            "carbs_g": round(data["carbs"] * factor, 1),
+            "advice": advice,
+            "confidence": round(similarity, 2),
+            "source": "local_db"
+        }
+
+    def extract_weight(self, text, portions=None, normalized=False):
+        """Извлекает вес из текста (quantities.food_weight), по умолчанию 100 г"""
+        return food_weight(text, portions, normalized=normalized)
 
-        for food_name, data in self.local_db.items():
-            if food_name in food_lower:
-                # Извлекаем вес
-                weight = self.extract_weight(food_lower)
-                factor = weight / 100
-
-                return {
-                    "calories": int(data["calories"] * factor),
-                    "protein_g": round(data["protein"] * factor, 1),
-                    "fat_g": round(data["fat"] * factor, 1),
-                    "carbs_g": round(data["carbs"] * factor, 1),
-                    "advice": "Данные из локальной базы продуктов",
-                    "confidence": "high",
-                    "source": "local_db"
-                }
-
-        return {"confidence": "low"}
-
-    def extract_weight(self, text):
-        """Извлекает вес из текста"""
-        patterns = [
-            r'(\d+)\s*г\b',
-            r'(\d+)\s*грамм',
-            r'(\d+)\s*гр\b',
+    def _chat_payload(self, system_prompt, user_prompt, max_tokens=500):
+        """Заголовки и тело запроса к OpenRouter"""
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
         ]
 
-        for pattern in patterns:
-            match = re.search(pattern, text.lower())
-            if match:
-                return int(match.group(1))
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
 
-        return 100  # стандартная порция
+        data = {
+            "model": "openai/gpt-3.5-turbo",
+            "messages": messages,
+            "temperature": 0.3,
+            "max_tokens": max_tokens,
+        }
 
-    def openrouter_estimate(self, food_text):
-        """Получаем КБЖУ через OpenRouter API"""
+        return headers, data
+
+    def _request_payload(self, food_text):
+        """Запрос оценки одного блюда"""
 
         # Промпт для оценки питания
-        messages = [
-            {
-                "role": "system",
-                "content": """Ты профессиональный диетолог. Отвечай ТОЛЬКО в JSON:
+        return self._chat_payload("""Ты профессиональный диетолог. Отвечай ТОЛЬКО в JSON:
 
 {
   "calories": число,
@@ -96,62 +379,306 @@ class OpenRouterNutrition:
   "advice": "краткий совет на русском"
 }
 
-Если вес не указан - используй средние порции. Будь точным и реалистичным."""
-            },
-            {
-                "role": "user",
-                "content": f"Оцени КБЖУ для: {food_text}"
-            }
-        ]
+Если вес не указан - используй средние порции. Будь точным и реалистичным.""",
+            f"Оцени КБЖУ для: {food_text}")
+
+    def _batch_payload(self, texts):
+        """Запрос оценки нескольких продуктов одного приема пищи"""
+        foods = '\n'.join(f"{i}. {text}" for i, text in enumerate(texts, 1))
+        return self._chat_payload("""Ты профессиональный диетолог. Оцени КБЖУ каждого продукта отдельно.
+Отвечай ТОЛЬКО в JSON, продукты в том же порядке:
+
+{
+  "items": [
+    {"food": "продукт", "calories": число, "protein_g": число, "fat_g": число, "carbs_g": число}
+  ],
+  "advice": "краткий совет на русском о приеме пищи в целом"
+}
 
+Если вес не указан - используй средние порции. Будь точным и реалистичным.""",
+            f"Оцени КБЖУ для продуктов:\n{foods}",
+            max_tokens=200 + 100 * len(texts))
+
+    def _parse_api_response(self, food_text, status_code, result, response_time):
+        """Ответ OpenRouter -> КБЖУ (или запасная оценка)"""
+        if status_code != 200:
+            print(f"❌ OpenRouter API error {status_code}")
+            return self.fallback_estimate(food_text)
+
+        if 'choices' not in result or not result['choices']:
+            print("❌ Нет choices в ответе OpenRouter")
+            return self.fallback_estimate(food_text)
+
+        content = result['choices'][0]['message']['content'].strip()
+        print(f"📨 Получен ответ за {response_time}мс: {content[:100]}...")
+
+        # Парсим JSON
+        parsed_data = self.parse_json_response(content)
+        if parsed_data:
+            parsed_data["source"] = "openrouter_gpt"
+            return parsed_data
+        else:
+            return self.fallback_estimate(food_text)
+
+    def _parse_batch_response(self, texts, status_code, result, response_time):
+        """Ответ OpenRouter на пакетный запрос -> КБЖУ по каждому продукту.
+
+        Продукты, которых нет в ответе или с неполными данными,
+        получают запасную оценку, остальные - ответ нейросети.
+        """
+        items = []
+        advice = None
+        if status_code != 200:
+            print(f"❌ OpenRouter API error {status_code}")
+        elif 'choices' not in result or not result['choices']:
+            print("❌ Нет choices в ответе OpenRouter")
+        else:
+            content = result['choices'][0]['message']['content'].strip()
+            print(f"📨 Получен ответ за {response_time}мс: {content[:100]}...")
+            parsed_data = self.parse_json_response(content, required=("items",))
+            if parsed_data and isinstance(parsed_data.get("items"), list):
+                items = parsed_data["items"]
+                advice = parsed_data.get("advice")
+
+        results = []
+        for i, text in enumerate(texts):
+            item = items[i] if i < len(items) and isinstance(items[i], dict) else {}
+            if all(field in item for field in NUTRITION_FIELDS):
+                item = {field: item[field] for field in NUTRITION_FIELDS}
+                item["advice"] = advice or "Сбалансированное блюдо."
+                item["source"] = "openrouter_gpt"
+                results.append(item)
+            else:
+                results.append(self.fallback_estimate(text))
+        return results
+
+    def openrouter_estimate(self, food_text):
+        """Получаем КБЖУ через OpenRouter API (блокирующий вызов, для скриптов)"""
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-            }
-
-            data = {
-                "model": "openai/gpt-3.5-turbo",
-                "messages": messages,
-                "temperature": 0.3,
-                "max_tokens": 500,
-            }
+            headers, data = self._request_payload(food_text)
 
             print(f"🤖 Отправляю запрос к OpenRouter: {food_text[:50]}...")
 
             start_time = time.time()
-            response = requests.post(self.base_url, headers=headers, json=data, timeout=30)
+            response = self._session.post(self.base_url, headers=headers, json=data, timeout=OPENROUTER_TIMEOUT)
             response_time = int((time.time() - start_time) * 1000)
 
-            if response.status_code != 200:
-                print(f"❌ OpenRouter API error {response.status_code}")
-                return self.fallback_estimate(food_text)
+            result = response.json() if response.status_code == 200 else None
+            return self._parse_api_response(food_text, response.status_code, result, response_time)
 
-            result = response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Ошибка сети OpenRouter: {e}")
+            return self.fallback_estimate(food_text)
+        except Exception as e:
+            print(f"❌ Ошибка OpenRouter: {e}")
+            return self.fallback_estimate(food_text)
 
-            if 'choices' not in result or not result['choices']:
-                print("❌ Нет choices в ответе OpenRouter")
-                return self.fallback_estimate(food_text)
+    def openrouter_batch_estimate(self, texts):
+        """КБЖУ нескольких продуктов одним запросом к OpenRouter (блокирующий вызов)"""
+        try:
+            headers, data = self._batch_payload(texts)
 
-            content = result['choices'][0]['message']['content'].strip()
-            print(f"📨 Получен ответ за {response_time}мс: {content[:100]}...")
+            print(f"🤖 Отправляю запрос к OpenRouter: {len(texts)} продуктов...")
 
-            # Парсим JSON
-            parsed_data = self.parse_json_response(content)
-            if parsed_data:
-                parsed_data["source"] = "openrouter_gpt"
-                return parsed_data
-            else:
-                return self.fallback_estimate(food_text)
+            start_time = time.time()
+            response = self._session.post(self.base_url, headers=headers, json=data, timeout=OPENROUTER_TIMEOUT)
+            response_time = int((time.time() - start_time) * 1000)
+
+            result = response.json() if response.status_code == 200 else None
+            return self._parse_batch_response(texts, response.status_code, result, response_time)
 
         except requests.exceptions.RequestException as e:
             print(f"❌ Ошибка сети OpenRouter: {e}")
+        except Exception as e:
+            print(f"❌ Ошибка OpenRouter: {e}")
+        return [self.fallback_estimate(text) for text in texts]
+
+    def _get_client(self):
+        """Общий асинхронный клиент: keep-alive пул соединений, HTTP/2 если есть h2"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=OPENROUTER_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=OPENROUTER_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENROUTER_MAX_CONNECTIONS,
+                    keepalive_expiry=OPENROUTER_KEEPALIVE_SECONDS
+                )
+            )
+            # Не больше OPENROUTER_MAX_CONCURRENCY запросов к API одновременно
+            self._semaphore = asyncio.Semaphore(OPENROUTER_MAX_CONCURRENCY)
+        return self._client
+
+    async def estimate_nutrition_async(self, food_text):
+        """То же, что estimate_nutrition, но не блокирует цикл событий бота"""
+        items = split_meal(food_text)
+        if len(items) > 1:
+            return await self.estimate_meal_async(items)
+
+        result = self.local_db_estimate(food_text)
+        if result and "source" in result:
+            return result
+
+        if self.api_key:
+            cached = await self.cached_estimate_async(food_text)
+            if cached:
+                return cached
+            return await self._single_flight(food_text)
+        else:
+            return self.fallback_estimate(food_text)
+
+    async def estimate_meal_async(self, items):
+        """Составной прием пищи: продукты без оценки - одним запросом к API.
+
+        Продукт, который уже запрашивается другим пользователем, ждет
+        тот запрос; каждый продукт пакета тоже регистрируется в полете,
+        чтобы одновременные сообщения с ним не делали своих запросов.
+        """
+        results, misses = await self._resolve_items_async(items)
+
+        waits = {}
+        batch = []
+        for i in misses:
+            key, weight = self._cache_key(items[i])
+            flight = self._in_flight.get(key) if key else None
+            if flight is not None:
+                waits[i] = self._follow(items[i], weight, flight)
+            else:
+                batch.append(i)
+
+        if len(batch) == 1:
+            waits[batch[0]] = self._single_flight(items[batch[0]])
+        elif batch:
+            texts = [items[i] for i in batch]
+            task = asyncio.ensure_future(self._fetch_batch_and_store(texts))
+            for n, text in enumerate(texts):
+                key, weight = self._cache_key(text)
+                if key and key not in self._in_flight:
+                    self._register_flight(key, weight, asyncio.ensure_future(self._batch_item(task, n)))
+
+            batch_results = await asyncio.shield(task)
+            for i, result in zip(batch, batch_results):
+                results[i] = dict(result)
+
+        if waits:
+            for i, result in zip(waits, await asyncio.gather(*waits.values())):
+                results[i] = result
+
+        return self._combine_items(items, results)
+
+    async def _fetch_and_store(self, food_text):
+        self.api_calls += 1
+        result = await self.openrouter_estimate_async(food_text)
+        await self.store_estimate_async(food_text, result)
+        return result
+
+    async def _fetch_batch_and_store(self, texts):
+        self.api_calls += 1
+        results = await self.openrouter_batch_estimate_async(texts)
+        for text, result in zip(texts, results):
+            await self.store_estimate_async(text, result)
+        return results
+
+    @staticmethod
+    async def _batch_item(task, index):
+        return (await asyncio.shield(task))[index]
+
+    def _register_flight(self, key, weight, task):
+        self._in_flight[key] = (task, weight)
+        task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+    async def _single_flight(self, food_text):
+        """Одинаковые запросы, пришедшие одновременно, ждут один вызов API.
+
+        Одинаковые - с тем же ключом кэша, поэтому "гречка 200г" и
+        "гречка 150г" тоже объединяются: ответ пересчитывается на свой вес.
+        """
+        key, weight = self._cache_key(food_text)
+        if key is None:
+            return await self._fetch_and_store(food_text)
+
+        flight = self._in_flight.get(key)
+        if flight is not None:
+            return await self._follow(food_text, weight, flight)
+
+        # Отдельная задача: отмена первого обработчика не отменяет запрос для остальных
+        task = asyncio.ensure_future(self._fetch_and_store(food_text))
+        self._register_flight(key, weight, task)
+        return dict(await asyncio.shield(task))
+
+    async def _follow(self, food_text, weight, flight):
+        """Ждем чужой запрос с тем же ключом и пересчитываем ответ на свой вес"""
+        task, leader_weight = flight
+        self.coalesced_calls += 1
+        result = await asyncio.shield(task)
+        if result.get("source") != "openrouter_gpt":
+            # API не ответил - своя запасная оценка по своему тексту
+            return self.fallback_estimate(food_text)
+        if weight and leader_weight:
+            return _scale_nutrition(result, weight / leader_weight)
+        return dict(result)
+
+    def coalescing_stats(self):
+        """Сколько вызовов API сделано и сколько сэкономлено объединением"""
+        total = self.api_calls + self.coalesced_calls
+        return {
+            'api_calls': self.api_calls,
+            'coalesced_calls': self.coalesced_calls,
+            'saved_rate': self.coalesced_calls / total if total else 0.0,
+        }
+
+    async def openrouter_estimate_async(self, food_text):
+        """Получаем КБЖУ через OpenRouter API асинхронно"""
+        try:
+            client = self._get_client()
+            headers, data = self._request_payload(food_text)
+
+            async with self._semaphore:
+                print(f"🤖 Отправляю запрос к OpenRouter: {food_text[:50]}...")
+
+                start_time = time.time()
+                response = await client.post(self.base_url, headers=headers, json=data)
+                response_time = int((time.time() - start_time) * 1000)
+
+            result = response.json() if response.status_code == 200 else None
+            return self._parse_api_response(food_text, response.status_code, result, response_time)
+
+        except httpx.HTTPError as e:
+            print(f"❌ Ошибка сети OpenRouter: {e}")
             return self.fallback_estimate(food_text)
         except Exception as e:
             print(f"❌ Ошибка OpenRouter: {e}")
             return self.fallback_estimate(food_text)
 
-    def parse_json_response(self, text):
+    async def openrouter_batch_estimate_async(self, texts):
+        """КБЖУ нескольких продуктов одним асинхронным запросом к OpenRouter"""
+        try:
+            client = self._get_client()
+            headers, data = self._batch_payload(texts)
+
+            async with self._semaphore:
+                print(f"🤖 Отправляю запрос к OpenRouter: {len(texts)} продуктов...")
+
+                start_time = time.time()
+                response = await client.post(self.base_url, headers=headers, json=data)
+                response_time = int((time.time() - start_time) * 1000)
+
+            result = response.json() if response.status_code == 200 else None
+            return self._parse_batch_response(texts, response.status_code, result, response_time)
+
+        except httpx.HTTPError as e:
+            print(f"❌ Ошибка сети OpenRouter: {e}")
+        except Exception as e:
+            print(f"❌ Ошибка OpenRouter: {e}")
+        return [self.fallback_estimate(text) for text in texts]
+
+    async def aclose(self):
+        """Закрываем пул соединений (при остановке бота)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def parse_json_response(self, text, required=("calories", "protein_g", "fat_g", "carbs_g", "advice")):
         """Парсим JSON из ответа"""
         # Очищаем от markdown
         text = text.replace('```json', '').replace('```', '').strip()
@@ -165,7 +692,6 @@ class OpenRouterNutrition:
             try:
                 data = json.loads(json_str)
                 # Проверяем обязательные поля
-                required = ["calories", "protein_g", "fat_g", "carbs_g", "advice"]
                 if all(field in data for field in required):
                     return data
             except json.JSONDecodeError:
@@ -198,7 +724,7 @@ class OpenRouterNutrition:
             advice = "Сбалансированное блюдо."
 
         # Корректируем по весу
-        weight = self.extract_weight(food_lower)
+        weight = self.extract_weight(food_text)
         calories = int(calories * weight / 100)
 
         return {
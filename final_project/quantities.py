@@ -0,0 +1,113 @@
+# quantities.py
+import re
+from collections import namedtuple
+
+from food_text import normalize_text
+
+# Вес по умолчанию, если количество не указано
+STANDARD_PORTION = 100
+
+# Граммы в одной штуке/ложке/стакане, если в справочнике нет своих
+DEFAULT_PORTIONS = {'piece': 100, 'tbsp': 15, 'tsp': 5, 'cup': 200}
+
+# Число без единицы: меньше - штуки ("2 яйца"), больше - граммы ("200 гречки")
+BARE_GRAMS_MIN = 10
+
+# Число целиком (не начало "2,5" или "250") и не процент жирности: "творог 5%"
+NUMBER = r'\d+(?:[.,]\d+)?(?![.,]?\d|\s*%)'
+
+# Все количества в тексте одним проходом: число, диапазон или "пол" и единица.
+# Единица - именованная группа, lastgroup сразу говорит, какая именно
+QUANTITY_RE = re.compile(
+    rf'(?<![\w.,])(?:(?P<value>{NUMBER})(?:\s*[-–—]\s*(?P<to>{NUMBER}))?\s*|(?P<half>пол-?\s?))?(?:'
+    r'(?P<tsp>ч\.?\s?л\.?|чайн[а-я]*\s+ложк[а-я]*|чайн[а-я]*\s+ложек)'
+    r'|(?P<tbsp>ст\.?\s?л\.?|столов[а-я]*\s+ложк[а-я]*|столов[а-я]*\s+ложек|ложк[а-я]*|ложек)'
+    r'|(?P<kg>кг|кило(?:грамм[а-я]*)?|kg)'
+    r'|(?P<g>гр|грамм[а-я]*|г|g)'
+    r'|(?P<ml>мл|миллилитр[а-я]*|ml)'
+    r'|(?P<l>л|литр[а-я]*|l)'
+    r'|(?P<piece>шт\.?|штук[а-я]*|штучк[а-я]*|кус[а-я]*|ломтик[а-я]*|ломтя|ломтей)'
+    r'|(?P<cup>стакан[а-я]*|чашк[а-я]*|чашек|кружк[а-я]*|кружек)'
+    r')?(?![a-zа-я])'
+)
+
+# Единица из регулярного выражения -> (единица количества, множитель)
+UNITS = {
+    'kg': ('g', 1000),
+    'g': ('g', 1),
+    'l': ('ml', 1000),
+    'ml': ('ml', 1),
+    'piece': ('piece', 1),
+    'tbsp': ('tbsp', 1),
+    'tsp': ('tsp', 1),
+    'cup': ('cup', 1),
+}
+
+Quantity = namedtuple('Quantity', 'value unit start end')
+
+
+def parse_quantities(text, normalized=False):
+    """Все количества в тексте: Quantity(значение, единица, начало, конец).
+
+    Единицы: g, ml (кг и литры пересчитываются), piece, tbsp, tsp, cup
+    и count - число без единицы. Диапазон "150-200 г" дает середину,
+    "стакан" без числа - один, "полстакана" - половину.
+    normalized=True - текст уже прошел food_text.normalize_text.
+    """
+    if not normalized:
+        text = normalize_text(text)
+    quantities = []
+    for match in QUANTITY_RE.finditer(text):
+        if match.start() == match.end():
+            continue
+
+        unit, factor = UNITS.get(match.lastgroup, ('count', 1))
+        number = match.group('value')
+        if number:
+            value = float(number.replace(',', '.'))
+            if match.group('to'):
+                value = (value + float(match.group('to').replace(',', '.'))) / 2
+        elif match.group('half'):
+            value = 0.5
+        elif unit in ('g', 'ml'):
+            # "г" или "литр" без числа - не количество
+            continue
+        else:
+            value = 1
+
+        quantities.append(Quantity(value * factor, unit, match.start(), match.end()))
+    return quantities
+
+
+def to_grams(quantity, portions=None):
+    """Количество в граммах; штуки, ложки и стаканы - по таблице порций продукта.
+
+    Небольшое число без единицы у продукта без веса штуки ("кефир 1")
+    в граммы не перевести - None.
+    """
+    portions = portions or {}
+    if quantity.unit in ('g', 'ml'):
+        # Плотность жидкостей считаем равной воде
+        return quantity.value
+    if quantity.unit == 'count':
+        if 'piece' not in portions:
+            return quantity.value if quantity.value >= BARE_GRAMS_MIN else None
+        unit = 'piece'
+    else:
+        unit = quantity.unit
+    return quantity.value * portions.get(unit, DEFAULT_PORTIONS[unit])
+
+
+def food_weight(text, portions=None, default=STANDARD_PORTION, normalized=False):
+    """Вес еды в граммах или стандартная порция, если количества нет.
+
+    Граммы и миллилитры важнее штук и ложек: "2 яйца 120 г" - 120 г.
+    Количества одного вида складываются.
+    """
+    quantities = parse_quantities(text, normalized)
+    measured = [quantity.value for quantity in quantities if quantity.unit in ('g', 'ml')]
+    if measured:
+        return sum(measured)
+
+    weights = [grams for grams in (to_grams(quantity, portions) for quantity in quantities) if grams is not None]
+    return sum(weights) if weights else default
@@ -0,0 +1,75 @@
+# report_cache.py
+import threading
+from collections import OrderedDict
+
+
+class ReportCache:
+    """LRU-кэш отчетов с версией данных на пользователя.
+
+    Ключ - (user_id, отчет, день). Каждая запись хранит версию данных
+    пользователя, при которой она посчитана. Новая еда поднимает версию,
+    и все отчеты этого пользователя перестают совпадать - без перебора ключей.
+    """
+
+    def __init__(self, max_size=10_000):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._versions = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _version(self, user_id):
+        return self._epoch, self._versions.get(user_id, 0)
+
+    def get_or_load(self, user_id, report, day, loader):
+        """Значение из кэша или loader(), если его нет или оно устарело"""
+        key = (user_id, report, day)
+
+        with self._lock:
+            version = self._version(user_id)
+            item = self._data.get(key)
+            if item is not None:
+                if item[0] == version:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                del self._data[key]
+            self.misses += 1
+
+        # Версию запомнили до чтения: если запись успела закоммититься
+        # во время загрузки, устаревший результат не попадет в кэш
+        value = loader()
+
+        with self._lock:
+            if self._version(user_id) == version:
+                self._data[key] = (version, value)
+                self._data.move_to_end(key)
+                while len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+
+        return value
+
+    def invalidate(self, user_id):
+        """Данные пользователя изменились (вызывать после commit)"""
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def clear(self):
+        """Сбросить кэш всех пользователей"""
+        with self._lock:
+            self._epoch += 1
+            self._data.clear()
+            self._versions.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._data),
+                'max_size': self.max_size,
+            }
@@ -0,0 +1,309 @@
+# sharding.py
+import os
+import sqlite3
+import threading
+import zlib
+
+from database import Database, READ_POOL_SIZE, GROUP_COMMIT
+from instrumentation import INSTRUMENT, QueryStats
+
+SHARD_COUNT = int(os.getenv('FOOD_DIARY_SHARDS', '1'))
+SHARD_DIR = os.getenv('FOOD_DIARY_SHARD_DIR', 'data/shards')
+
+# Таблицы с данными пользователя и их колонки (без суррогатных id)
+USER_TABLES = {
+    'users': 'user_id, username, first_name, created_at, timezone',
+    'food_entries': 'user_id, food_text, calories, protein_g, fat_g, carbs_g, advice, created_at, local_day',
+    'daily_totals': 'user_id, date, total_calories, total_protein, total_fat, total_carbs',
+    'weekly_totals': 'user_id, week_start, total_calories, total_protein, total_fat, total_carbs, days_count',
+    'monthly_totals': 'user_id, month, total_calories, total_protein, total_fat, total_carbs, days_count',
+    'user_food_terms': 'user_id, term, word, count, last_seen',
+}
+
+ARCHIVE_TABLE_COLUMNS = 'user_id, food_text, calories, protein_g, fat_g, carbs_g, advice, created_at, local_day'
+
+# Методы Database без user_id, которые выполняются на каждом шарде
+FAN_OUT_METHODS = {'create_tables', 'backfill_local_day'}
+
+# Методы без user_id, которые достаточно вызвать на любом шарде
+# (статистика запросов у шардов общая)
+SHARED_METHODS = {'query_stats', 'query_report'}
+
+
+def stable_shard(user_id, shard_count):
+    """Шард по стабильному хэшу user_id (не зависит от PYTHONHASHSEED)"""
+    return zlib.crc32(str(user_id).encode()) % shard_count
+
+
+class ShardDirectory:
+    """Справочник user_id -> шард.
+
+    Пользователь закрепляется за шардом при первом обращении, поэтому
+    изменение числа шардов никого не перемещает - это делает rebalance.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_shards (
+            user_id INTEGER PRIMARY KEY,
+            shard INTEGER NOT NULL
+        )
+        ''')
+        self.conn.commit()
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def lookup(self, user_id, default):
+        if user_id in self._cache:
+            return self._cache[user_id]
+
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT shard FROM user_shards WHERE user_id = ?', (user_id,)
+            ).fetchone()
+            if row:
+                shard = row[0]
+            else:
+                shard = default
+                self.conn.execute(
+                    'INSERT INTO user_shards (user_id, shard) VALUES (?, ?)', (user_id, shard)
+                )
+                self.conn.commit()
+
+        self._cache[user_id] = shard
+        return shard
+
+    def assign(self, user_id, shard):
+        with self._lock:
+            self.conn.execute('''
+            INSERT INTO user_shards (user_id, shard) VALUES (?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET shard = excluded.shard
+            ''', (user_id, shard))
+            self.conn.commit()
+        self._cache[user_id] = shard
+
+    def all_users(self):
+        with self._lock:
+            return self.conn.execute('SELECT user_id, shard FROM user_shards ORDER BY user_id').fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+class ShardedDatabase:
+    """Хранилище, разделенное по пользователям на N файлов SQLite.
+
+    API совпадает с Database: методы с user_id уходят в шард пользователя,
+    административные запросы выполняются на всех шардах и складываются.
+    У каждого шарда свой писатель, поэтому запись масштабируется числом
+    файлов (и дисков).
+    """
+
+    def __init__(self, shard_count=SHARD_COUNT, shard_dir=SHARD_DIR,
+                 pool_size=READ_POOL_SIZE, group_commit=GROUP_COMMIT, synchronous=None,
+                 instrument=INSTRUMENT):
+        os.makedirs(shard_dir, exist_ok=True)
+        self.shard_count = shard_count
+        query_stats = QueryStats() if instrument else None
+        self.shards = [
+            Database(
+                os.path.join(shard_dir, f'food_diary_{i}.db'),
+                pool_size,
+                group_commit,
+                synchronous,
+                archive_dir=os.path.join(shard_dir, f'archive_{i}'),
+                instrument=instrument,
+                query_stats=query_stats
+            )
+            for i in range(shard_count)
+        ]
+        self.directory = ShardDirectory(os.path.join(shard_dir, 'directory.db'))
+
+    def shard_index(self, user_id):
+        return self.directory.lookup(user_id, stable_shard(user_id, self.shard_count))
+
+    def for_user(self, user_id):
+        return self.shards[self.shard_index(user_id)]
+
+    def database_files(self):
+        files = [path for shard in self.shards for path in shard.database_files()]
+        return files + [self.directory.path]
+
+    def __getattr__(self, name):
+        if name in FAN_OUT_METHODS:
+            def fan_out(*args, **kwargs):
+                return [getattr(shard, name)(*args, **kwargs) for shard in self.shards]
+            return fan_out
+
+        if name in SHARED_METHODS:
+            return getattr(self.shards[0], name)
+
+        # Остальные методы Database принимают user_id первым аргументом
+        def routed(user_id, *args, **kwargs):
+            return getattr(self.for_user(user_id), name)(user_id, *args, **kwargs)
+        return routed
+
+    @property
+    def batcher(self):
+        # Групповая запись включается на всех шардах одинаково
+        return self.shards[0].batcher
+
+    def rebuild_rollups(self, user_id=None):
+        if user_id is not None:
+            return self.for_user(user_id).rebuild_rollups(user_id)
+        for shard in self.shards:
+            shard.rebuild_rollups()
+
+    def rebuild_food_terms(self, user_id=None):
+        if user_id is not None:
+            return self.for_user(user_id).rebuild_food_terms(user_id)
+        for shard in self.shards:
+            shard.rebuild_food_terms()
+
+    def cache_stats(self):
+        stats = [shard.cache_stats() for shard in self.shards]
+        total = {key: sum(item[key] for item in stats) for key in ('hits', 'misses', 'size', 'max_size')}
+        requests = total['hits'] + total['misses']
+        total['hit_rate'] = total['hits'] / requests if requests else 0.0
+        return total
+
+    def get_global_stats(self):
+        stats = [shard.get_global_stats() for shard in self.shards]
+        return {key: sum(item[key] for item in stats) for key in stats[0]}
+
+    def move_user(self, user_id, target):
+        """Переносим все данные пользователя в шард target.
+
+        Порядок: копия в целевом шарде -> справочник -> удаление из старого.
+        После сбоя пользователь может остаться в двух шардах, но читается
+        всегда из одного, и повторный перенос убирает остаток.
+        Запускать при остановленном боте или без его записей в этот момент.
+        """
+        source_index = self.shard_index(user_id)
+        if source_index == target:
+            return False
+
+        source = self.shards[source_index]
+        destination = self.shards[target]
+
+        with source.pool.writer() as src, destination.pool.writer() as dst:
+            for table, columns in USER_TABLES.items():
+                rows = src.execute(
+                    f'SELECT {columns} FROM {table} WHERE user_id = ?', (user_id,)
+                ).fetchall()
+                dst.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
+                if rows:
+                    placeholders = ','.join('?' * len(rows[0]))
+                    dst.executemany(
+                        f'INSERT INTO {table} ({columns}) VALUES ({placeholders})', rows
+                    )
+            dst.commit()
+            self._move_archive(user_id, source, src, destination, dst)
+
+            self.directory.assign(user_id, target)
+
+            for table in USER_TABLES:
+                src.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
+
+        for shard in (source, destination):
+            shard.cache.invalidate(user_id)
+            shard._timezones.pop(user_id, None)
+        return True
+
+    @staticmethod
+    def _reserve_entry_ids(conn, count):
+        """Первый из count id food_entries, которые шард больше никогда не выдаст.
+
+        Архив хранит записи с их id из горячей базы, а архиватор пишет в
+        него INSERT OR REPLACE по id. Перенесенные архивные записи берут
+        id из sqlite_sequence целевого шарда и сдвигают его, иначе они
+        совпали бы с id еще не заархивированных записей и были бы
+        перезаписаны при следующей архивации.
+        """
+        row = conn.execute("SELECT seq FROM main.sqlite_sequence WHERE name = 'food_entries'").fetchone()
+        max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM main.food_entries').fetchone()[0]
+        last = max(row[0] if row else 0, max_id)
+
+        if row:
+            conn.execute("UPDATE main.sqlite_sequence SET seq = ? WHERE name = 'food_entries'", (last + count,))
+        else:
+            conn.execute("INSERT INTO main.sqlite_sequence (name, seq) VALUES ('food_entries', ?)", (last + count,))
+        return last + 1
+
+    def _move_archive(self, user_id, source, src, destination, dst):
+        """Архивные записи пользователя переезжают вместе с ним (с новыми id)"""
+        if src.in_transaction:
+            src.commit()
+
+        for year in source.archive.years():
+            with source.archive.attached(src, year) as src_schema:
+                rows = src.execute(
+                    f'SELECT {ARCHIVE_TABLE_COLUMNS} FROM {src_schema}.food_entries WHERE user_id = ?',
+                    (user_id,)
+                ).fetchall()
+                if not rows:
+                    continue
+
+                os.makedirs(destination.archive.archive_dir, exist_ok=True)
+                with destination.archive.attached(dst, year) as dst_schema:
+                    destination.archive._ensure_schema(dst, dst_schema)
+                    # id резервируем отдельным commit: после сбоя пропадет только диапазон
+                    first_id = self._reserve_entry_ids(dst, len(rows))
+                    dst.commit()
+
+                    dst.execute(f'DELETE FROM {dst_schema}.food_entries WHERE user_id = ?', (user_id,))
+                    dst.executemany(
+                        f'INSERT INTO {dst_schema}.food_entries (id, {ARCHIVE_TABLE_COLUMNS}) '
+                        f'VALUES ({",".join("?" * 10)})',
+                        ((first_id + i, *row) for i, row in enumerate(rows))
+                    )
+                    dst.commit()
+
+                src.execute(f'DELETE FROM {src_schema}.food_entries WHERE user_id = ?', (user_id,))
+                src.commit()
+
+    def rebalance(self):
+        """Переносим пользователей туда, куда их направляет хэш при текущем числе шардов"""
+        moved = 0
+        for user_id, shard in self.directory.all_users():
+            target = stable_shard(user_id, self.shard_count)
+            if shard != target and self.move_user(user_id, target):
+                moved += 1
+        return moved
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        self.directory.close()
+
+
+def open_database():
+    """Database или ShardedDatabase в зависимости от FOOD_DIARY_SHARDS"""
+    if SHARD_COUNT > 1:
+        return ShardedDatabase()
+    return Database()
+
+
+if __name__ == '__main__':
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+
+    # python sharding.py move <user_id> <шард>
+    if command == 'move':
+        db = ShardedDatabase()
+        db.move_user(int(sys.argv[2]), int(sys.argv[3]))
+        db.close()
+        print("✅ Пользователь перенесен")
+    # python sharding.py rebalance
+    elif command == 'rebalance':
+        db = ShardedDatabase()
+        print(f"✅ Перенесено пользователей: {db.rebalance()}")
+        db.close()
+    else:
+        print("Использование:")
+        print("  python sharding.py move <user_id> <шард>")
+        print("  python sharding.py rebalance")
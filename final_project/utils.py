@@ -1,4 +1,14 @@
-from datetime import datetime
+import re
+from datetime import datetime, timezone
+
+# Символы разметки Markdown: непарный из текста пользователя ломает сообщение
+MARKDOWN_RE = re.compile(r'[*_`\[]')
+
+
+def strip_markdown(text):
+    """Текст пользователя без символов разметки Markdown"""
+    return MARKDOWN_RE.sub('', text or '')
+
 
 def format_nutrition_response(nutrition_data, food_text):
     """Форматируем ответ с КБЖУ"""
@@ -14,6 +24,17 @@ def format_nutrition_response(nutrition_data, food_text):
     response += f"• 🥑 *Жиры:* `{nutrition_data['fat_g']:.1f} г`\n"
     response += f"• 🍚 *Углеводы:* `{nutrition_data['carbs_g']:.1f} г`\n\n"
 
+    # Составной прием пищи - КБЖУ каждого продукта
+    if nutrition_data.get('items'):
+        response += f"🧩 *ПО ПРОДУКТАМ:*\n"
+        for item in nutrition_data['items']:
+            food = strip_markdown(item['food'])
+            response += (
+                f"• {food}: `{item['calories']} ккал`, "
+                f"Б `{item['protein_g']:.1f}` Ж `{item['fat_g']:.1f}` У `{item['carbs_g']:.1f}`\n"
+            )
+        response += "\n"
+
     response += f"💡 *РЕКОМЕНДАЦИИ:*\n"
     response += f"_{nutrition_data['advice']}_\n\n"
 
@@ -57,7 +78,7 @@ def format_daily_summary(summary_data, entries):
             food_text, calories, protein, fat, carbs, advice, time = entry
             time_str = datetime.strptime(time, '%Y-%m-%d %H:%M:%S').strftime('%H:%M')
 
-            response += f"\n{i}. *{time_str}* - {food_text}\n"
+            response += f"\n{i}. *{time_str}* - {strip_markdown(food_text)}\n"
             response += f"   🔥 {calories} ккал | 🥚 {protein:.1f}г | 🥑 {fat:.1f}г | 🍚 {carbs:.1f}г\n"
 
     return response
@@ -113,6 +134,20 @@ def format_weekly_analysis(week_data):
     return response
 
 
+def format_weeks_comparison(weeks_data):
+    """Сравнение средних показателей по неделям"""
+    if not weeks_data or len(weeks_data) < 2:
+        return ""
+
+    response = "\n\n🗓 *ПО НЕДЕЛЯМ (среднее в день):*\n"
+    for week_start, avg_cal, avg_prot, avg_fat, avg_carbs, days_count in weeks_data:
+        week_formatted = datetime.strptime(week_start, '%Y-%m-%d').strftime('%d.%m')
+        response += f"\n• *с {week_formatted}* ({days_count} дн.):\n"
+        response += f"  🔥 {avg_cal:.0f} ккал | 🥚 {avg_prot:.1f}г | 🥑 {avg_fat:.1f}г | 🍚 {avg_carbs:.1f}г"
+
+    return response
+
+
 def format_monthly_analysis(month_data):
     """Форматируем месячную статистику с единым стилем"""
     if not month_data:
@@ -163,12 +198,12 @@ def get_meal_time():
         return "ночной перекус 🌙"
 
 
-def format_general_stats(all_entries, common_words):
+def format_general_stats(entries_count, common_words):
     """Форматируем общую статистику с единым стилем"""
     response = "📊 *ОБЩАЯ СТАТИСТИКА*\n"
     response += "═" * 35 + "\n\n"
 
-    response += f"📝 *Всего записей:* `{len(all_entries)}`\n\n"
+    response += f"📝 *Всего записей:* `{entries_count}`\n\n"
 
     if common_words:
         response += "🍽 *ЧАСТЫЕ ПРОДУКТЫ:*\n"
@@ -182,4 +217,68 @@ def format_general_stats(all_entries, common_words):
     response += "• 📅 *Месяц* - сравнение по месяцам\n"
     response += "• 📊 *График* - визуализация данных"
 
-    return response
\ No newline at end of file
+    return response
+
+
+def encode_history_cursor(older, created_at, entry_id):
+    """Курсор /history для callback_data: h:o:<время36>.<id36> (до 64 байт)"""
+    moment = datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    return f"h:{'o' if older else 'n'}:{_to_base36(int(moment.timestamp()))}.{_to_base36(entry_id)}"
+
+
+def decode_history_cursor(data):
+    """callback_data -> (older, (created_at, id)) или None"""
+    try:
+        _, direction, payload = data.split(':')
+        ts, entry_id = payload.split('.')
+        moment = datetime.fromtimestamp(int(ts, 36), tz=timezone.utc)
+        return direction == 'o', (moment.strftime('%Y-%m-%d %H:%M:%S'), int(entry_id, 36))
+    except (ValueError, OverflowError, OSError):
+        return None
+
+
+def _to_base36(number):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    result = ''
+    while True:
+        number, rest = divmod(number, 36)
+        result = digits[rest] + result
+        if number == 0:
+            return result
+
+
+def format_history_page(page):
+    """Форматируем страницу истории приемов пищи"""
+    response = "📜 *ИСТОРИЯ ПИТАНИЯ*\n"
+    response += "═" * 35 + "\n"
+
+    if not page['entries']:
+        return response + "\n📭 *Записей нет*\n\nИспользуйте ➕ Добавить еду чтобы начать!"
+
+    for entry in page['entries']:
+        _, food_text, calories, protein, fat, carbs, _, local_time = entry
+        time_str = datetime.strptime(local_time, '%Y-%m-%d %H:%M:%S').strftime('%d.%m %H:%M')
+
+        response += f"\n*{time_str}* - {strip_markdown(food_text)}\n"
+        response += f"   🔥 {calories} ккал | 🥚 {protein:.1f}г | 🥑 {fat:.1f}г | 🍚 {carbs:.1f}г\n"
+
+    return response
+
+
+def format_search_results(query, entries):
+    """Форматируем результаты поиска по дневнику"""
+    # Спецсимволы Markdown из запроса и записей сломали бы разметку
+    response = f"🔎 *ПОИСК:* {strip_markdown(query)}\n"
+    response += "═" * 35 + "\n"
+
+    if not entries:
+        return response + "\n📭 *Ничего не найдено*"
+
+    for entry in entries:
+        _, food_text, calories, protein, fat, carbs, _, local_time = entry
+        time_str = datetime.strptime(local_time, '%Y-%m-%d %H:%M:%S').strftime('%d.%m.%Y %H:%M')
+
+        response += f"\n*{time_str}* - {strip_markdown(food_text)}\n"
+        response += f"   🔥 {calories} ккал | 🥚 {protein:.1f}г | 🥑 {fat:.1f}г | 🍚 {carbs:.1f}г\n"
+
+    return response